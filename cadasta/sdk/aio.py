@@ -0,0 +1,360 @@
+import asyncio
+from collections import deque
+import json
+import logging
+import os
+
+try:
+    import aiohttp
+except ImportError:
+    raise ImportError("Missing optional dependency: \"aiohttp\"")
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from .connection import BaseSessionMixin, _get_features, _page_urls
+from .endpoints import join_url, LOGIN, S3_UPLOAD
+from .retry import RetryPolicy
+
+__all__ = ('AsyncCadastaSession', 'AsyncResponse')
+logger = logging.getLogger(__name__)
+
+
+class AsyncResponse(object):
+    """
+    Fully read response, mirroring the parts of the `requests.Response` API
+    used with `CadastaSession` so that response handling code can be shared.
+    """
+
+    def __init__(self, method, url, status_code, headers, content,
+                 request_info=None):
+        self.method = method
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        if request_info is None:
+            request_info = aiohttp.RequestInfo(
+                URL(url), method, CIMultiDictProxy(CIMultiDict()))
+        self.request_info = request_info
+
+    def __repr__(self):
+        return '<AsyncResponse [{}]>'.format(self.status_code)
+
+    def __bool__(self):
+        return self.ok
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise aiohttp.ClientResponseError(
+                self.request_info, (), status=self.status_code,
+                headers=self.headers,
+                message='{} {} for url: {}'.format(
+                    self.status_code, self.text[:200], self.url))
+
+
+class AsyncCadastaSession(BaseSessionMixin):
+
+    def __init__(self, base_url='https://platform.cadasta.org',
+                 username=None, keyring=True, token=None,
+                 token_keyword='token', raise_for_status=True, limit=100,
+                 limit_per_host=0, keep_alive=True, retry=True, timeout=300,
+                 rate_limiter=None):
+        """
+        Asyncio counterpart of `CadastaSession`, built on aiohttp. Must be
+        used as an async context manager (or opened with `open()` and
+        closed with `close()`), which logs in if no token is provided:
+
+            async with AsyncCadastaSession(url, username='me') as cnxn:
+                resp = await cnxn.get(endpoints.projects(org_slug))
+
+        Args:
+            base_url, username, keyring, token, token_keyword,
+            raise_for_status, retry, rate_limiter: See `CadastaSession`.
+            limit (int, optional): Maximum number of simultaneous
+                connections, i.e. requests in flight. Defaults to 100.
+            limit_per_host (int, optional): Maximum number of simultaneous
+                connections per host. Defaults to 0 (no limit).
+            keep_alive (bool, optional): Reuse connections between requests.
+                Defaults to True.
+            timeout (float, optional): Total timeout in seconds of a single
+                request. Defaults to 300.
+        """
+        self._set_base_url(base_url)
+
+        if retry is True:
+            retry = RetryPolicy()
+        self.retry = retry or RetryPolicy(total=0)
+        self.raise_for_status = raise_for_status
+        self.token = token
+        self.rate_limiter = rate_limiter
+        self.observers = []
+
+        self._username = username
+        self._keyring = keyring
+        self._token_keyword = token_keyword
+        self._connector_kwargs = dict(
+            limit=limit, limit_per_host=limit_per_host,
+            force_close=not keep_alive)
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session = None
+        self.s3_session = None
+        self._csrf_lock = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self):
+        """ Create underlying HTTP sessions and login if needed """
+        # As with `CadastaSession`, S3 uploads go through a separate session
+        # so that they don't receive the API's auth headers.
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(**self._connector_kwargs),
+            timeout=self._timeout)
+        self.s3_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(**self._connector_kwargs),
+            timeout=self._timeout)
+        self._csrf_lock = asyncio.Lock()
+        if not self.token:
+            self.token = await self.login(self._username, self._keyring)
+        self._session.headers['Authorization'] = '{} {}'.format(
+            self._token_keyword, self.token)
+
+    async def close(self):
+        for session in (self._session, self.s3_session):
+            if session is not None:
+                await session.close()
+
+    async def login(self, username=None, keyring=True):
+        """ Login to session """
+        username = (username or self._get_username()).lower()
+        password = self._get_password(username, keyring)
+        try:
+            resp = await self.post(
+                LOGIN,
+                data={'username': username, 'password': password}
+            )
+        except Exception:
+            if keyring:
+                self.flush_keyring(username)
+            raise
+        return resp.json()['auth_token']
+
+    async def request(self, method, endpoint, raise_for_status=None,
+                      follow_pagination=False, retry=None, prefetch=0,
+                      **kw):
+        """
+        Send request to endpoint (or full URL), retrying failures according
+        to the session's retry policy. Keyword arguments are passed to
+        `aiohttp.ClientSession.request`. Returns an `AsyncResponse`, or an
+        async generator of results if `follow_pagination` is set.
+        """
+        assert self._session is not None, "Session has not been opened"
+        if not endpoint.startswith('http'):
+            endpoint = self.expand_endpoint_url(endpoint)
+        if raise_for_status is None:
+            raise_for_status = self.raise_for_status and method != 'HEAD'
+        if retry is None:
+            retry = self.retry
+        resp = await self._send_with_retry(
+            self._session, method, endpoint, retry or RetryPolicy(total=0),
+            **kw)
+        if raise_for_status:
+            try:
+                resp.raise_for_status()
+            except aiohttp.ClientResponseError:
+                logging.error("RESPONSE: {}".format(resp.text))
+                raise
+        if follow_pagination:
+            return self.follow_pagination(resp.json(), prefetch=prefetch)
+        return resp
+
+    async def get(self, endpoint, **kw):
+        return await self.request('GET', endpoint, **kw)
+
+    async def options(self, endpoint, **kw):
+        return await self.request('OPTIONS', endpoint, **kw)
+
+    async def head(self, endpoint, **kw):
+        return await self.request('HEAD', endpoint, **kw)
+
+    async def post(self, endpoint, **kw):
+        return await self.request('POST', endpoint, **kw)
+
+    async def put(self, endpoint, **kw):
+        return await self.request('PUT', endpoint, **kw)
+
+    async def patch(self, endpoint, **kw):
+        return await self.request('PATCH', endpoint, **kw)
+
+    async def delete(self, endpoint, **kw):
+        return await self.request('DELETE', endpoint, **kw)
+
+    async def _send_with_retry(self, session, method, url, policy, **kw):
+        attempt = 0
+        loop = asyncio.get_event_loop()
+        while True:
+            if self.rate_limiter is not None:
+                # Reserving may block on a lock file (`FileTokenBucket`)
+                await asyncio.sleep(await loop.run_in_executor(
+                    None, self.rate_limiter.reserve, method))
+            start = loop.time()
+            try:
+                async with session.request(method, url, **kw) as r:
+                    resp = AsyncResponse(method, str(r.url), r.status,
+                                         r.headers, await r.read(),
+                                         r.request_info)
+            except (aiohttp.ClientConnectionError,
+                    asyncio.TimeoutError) as e:
+                self._notify_observers(method, url, None, e,
+                                       loop.time() - start, attempt)
+                if not (policy.is_retryable(method, attempt, exc=e) and
+                        policy.consume()):
+                    raise
+                resp = None
+                reason = e.__class__.__name__
+            else:
+                self._notify_observers(method, url, resp, None,
+                                       loop.time() - start, attempt)
+                if not (policy.is_retryable(method, attempt, resp=resp) and
+                        policy.consume()):
+                    return resp
+                reason = resp.status_code
+            delay = policy.get_backoff(attempt, resp)
+            attempt += 1
+            logger.warning("%s %s failed (%s), retry %d in %.2fs",
+                           method, url, reason, attempt, delay)
+            await asyncio.sleep(delay)
+
+    async def follow_pagination(self, data, prefetch=0):
+        """
+        Async generator following a standard or GeoJSON paginated response.
+        See `CadastaSession.follow_pagination`.
+
+            async for party in cnxn.follow_pagination(data, prefetch=4):
+                ...
+        """
+        assert isinstance(data, dict), (
+            "Malformed response payload. Expected 'dict', got "
+            "{!r}".format(type(data)))
+        features = _get_features(data)
+        if features is not None:
+            get_items, page_size = _get_features, len(features)
+        else:
+            assert 'next' in data, (
+                "Malformed response payload. Missing 'next' key.")
+            assert 'results' in data, (
+                "Malformed response payload. Missing 'result' key.")
+            get_items, page_size = (lambda d: d['results'],
+                                    len(data['results']))
+        async for page in self._iter_pages(data, page_size, prefetch):
+            for item in get_items(page):
+                yield item
+
+    async def _iter_pages(self, data, page_size, prefetch=0):
+        if not prefetch:
+            while True:
+                yield data
+                if not data.get('next'):
+                    return
+                data = await self._get_json(data['next'])
+
+        urls = None
+        if data.get('next') and data.get('count'):
+            urls = _page_urls(data['next'], data['count'], page_size)
+        pending = deque()
+        try:
+            while True:
+                if urls is not None:
+                    for url in urls:
+                        pending.append(
+                            asyncio.ensure_future(self._get_json(url)))
+                        if len(pending) >= prefetch:
+                            break
+                elif data.get('next') and not pending:
+                    pending.append(
+                        asyncio.ensure_future(self._get_json(data['next'])))
+                yield data
+                if not pending:
+                    return
+                data = await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _get_json(self, url):
+        return (await self.get(url)).json()
+
+    async def get_csrf(self):
+        """
+        Retrieve CSRF for non-API endpoints, fetching it only once when
+        requested concurrently.
+        """
+        async with self._csrf_lock:
+            if not self._get_cookie('csrftoken'):
+                await self.get(self.expand_endpoint_url('/dashboard'))
+        token = self._get_cookie('csrftoken')
+        assert token, "No CSRF token found in cookie"
+        return token
+
+    def _get_cookie(self, name):
+        cookie = self._session.cookie_jar.filter_cookies(self.BASE_URL).get(
+            name)
+        return cookie.value if cookie else None
+
+    async def upload_file(self, file_path, upload_to=None):
+        """ Upload file a provided path to S3. Returns URL of uploaded file """
+        headers = {
+            'Referer': self.BASE_URL,
+            'X-CSRFToken': await self.get_csrf(),
+        }
+        key = os.path.basename(file_path)
+        # HACK: See `CadastaSession.upload_file`
+        if upload_to:
+            key = upload_to + '/' + key
+        policy = (await self.post(
+            S3_UPLOAD,
+            data={'key': key},
+            headers=headers,
+        )).json()
+
+        # HACK: See `CadastaSession.upload_file`
+        session = self.s3_session
+        if policy['url'].startswith('/'):
+            session = self._session
+            policy['url'] = (self.BASE_URL + policy['url'])
+        # The file is opened and closed in the default executor, and aiohttp
+        # reads file payloads there too, so file I/O doesn't block the event
+        # loop. Unlike a generator, a file has a known size, so the upload
+        # has a Content-Length (S3 rejects chunked uploads).
+        loop = asyncio.get_event_loop()
+        f = await loop.run_in_executor(None, open, file_path, 'rb')
+        try:
+            form = aiohttp.FormData(policy['fields'])
+            form.add_field('file', f, filename=os.path.basename(file_path))
+            resp = await self._send_with_retry(
+                session, 'POST', policy['url'], RetryPolicy(total=0),
+                data=form,
+                headers=headers if session is self._session else {}
+            )
+        finally:
+            await loop.run_in_executor(None, f.close)
+        if not resp.ok:
+            logging.error("RESPONSE: {}".format(resp.text))
+            resp.raise_for_status()
+        return join_url(policy['url'], policy['fields']['key'])
+
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+import json
+import sqlite3
+import threading
+import time
+
+__all__ = ('ResponseCache', 'UploadCache')
+
+
+class UploadCache(object):
+
+    def __init__(self, path=':memory:'):
+        """
+        SQLite-backed map of file content hashes to the URLs of previously
+        uploaded copies of that content. Safe to share between threads.
+
+        Args:
+            path (str, optional): Location of the SQLite database. Use a file
+                path to keep the cache between runs. Defaults to ':memory:'.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS uploads ('
+                '  base_url TEXT NOT NULL,'
+                '  upload_to TEXT NOT NULL,'
+                '  digest TEXT NOT NULL,'
+                '  file_url TEXT NOT NULL,'
+                '  PRIMARY KEY (base_url, upload_to, digest))')
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(self.__class__.__name__, self.path)
+
+    def get(self, base_url, upload_to, digest):
+        """ Return URL of file uploaded with the given hash, or None """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT file_url FROM uploads WHERE base_url = ? AND '
+                'upload_to = ? AND digest = ?',
+                (base_url, upload_to or '', digest)).fetchone()
+        return row[0] if row else None
+
+    def set(self, base_url, upload_to, digest, file_url):
+        """ Record URL of file uploaded with the given hash """
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)',
+                (base_url, upload_to or '', digest, file_url))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache(object):
+
+    def __init__(self, maxsize=1000, path=None):
+        """
+        Cache of the bodies of GET responses carrying validators (`ETag` or
+        `Last-Modified` headers). Sessions given a response cache send the
+        validators of cached responses with `If-None-Match` and
+        `If-Modified-Since`, and serve the cached body when the server
+        replies 304 Not Modified. Responses are kept in memory, least
+        recently used first evicted, and optionally in SQLite so that they
+        are reused between runs. Safe to share between threads, but not
+        between sessions authenticated as different users.
+
+        Args:
+            maxsize (int, optional): Maximum number of responses held in
+                memory. Defaults to 1000.
+            path (str, optional): Location of a SQLite database also storing
+                every cached response. Defaults to None (memory only).
+        """
+        self.maxsize = maxsize
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            with self._db:
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS responses ('
+                    '  url TEXT PRIMARY KEY,'
+                    '  headers TEXT NOT NULL,'
+                    '  content BLOB NOT NULL,'
+                    '  stored_at REAL NOT NULL)')
+
+    def __repr__(self):
+        return '<{} {!r} size={}>'.format(
+            self.__class__.__name__, self.path, len(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, url):
+        """
+        Return cached (headers, content) of a URL, or None. Headers are a
+        dict, holding the validators.
+        """
+        with self._lock:
+            entry = self._entries.pop(url, None)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    'SELECT headers, content FROM responses WHERE url = ?',
+                    (url,)).fetchone()
+                if row is not None:
+                    entry = (json.loads(row[0]), bytes(row[1]))
+            if entry is not None:
+                self._remember(url, entry)
+            return entry
+
+    def set(self, url, headers, content):
+        """ Cache headers (dict) and content of a response to a URL """
+        entry = (dict(headers), content)
+        with self._lock:
+            self._entries.pop(url, None)
+            self._remember(url, entry)
+            if self._db is not None:
+                with self._db:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                        (url, json.dumps(entry[0]), sqlite3.Binary(content),
+                         time.time()))
+
+    def _remember(self, url, entry):
+        self._entries[url] = entry
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def conditional_headers(headers):
+        """ Return request headers revalidating a response's headers """
+        conditions = {}
+        for header, condition in (('ETag', 'If-None-Match'),
+                                  ('Last-Modified', 'If-Modified-Since')):
+            value = _get_header(headers, header)
+            if value:
+                conditions[condition] = value
+        return conditions
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+
+
+def _get_header(headers, name):
+    """ Case-insensitive lookup of a header in a dict """
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
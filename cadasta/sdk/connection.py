@@ -1,23 +1,113 @@
+from collections import deque, namedtuple
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 import getpass
+import json
 import logging
+import math
+import os
 import time
 
-from six import wraps, moves
+from six import moves, string_types, wraps
+from six.moves.urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
 import keyring as keyringlib
 import requests
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
 import yaml
 
-from .endpoints import join_url, LOGIN, S3_UPLOAD
+from .endpoints import join_url, resolve, LOGIN, S3_UPLOAD
+from .helpers.fs import file_hash
+from .helpers.http import get_mime_type, IterReader, MultipartEncoder
+from .cache import _get_header
+from .retry import RetryPolicy
+from .schema import SchemaCache, ValidationError, VALIDATED_ENDPOINTS, validate
 
-__all__ = ('CadastaSession',)
+__all__ = ('CadastaSession', 'ResourceResult')
 logger = logging.getLogger(__name__)
 
+# Outcome of creating a Resource from a file: the created Resource, or the
+# error that prevented it
+ResourceResult = namedtuple('ResourceResult', ('file', 'resource', 'error'))
 
-class CadastaSession(requests.Session):
+
+class BaseSessionMixin(object):
+    """
+    Base URL and credential handling shared by the synchronous and
+    asynchronous sessions.
+    """
+
+    def __repr__(self):
+        return '<{}>'.format(self.BASE_URL)
+
+    def _set_base_url(self, base_url):
+        assert (base_url.startswith('https://') or
+                base_url.startswith('http://')), (
+                "\"base_url\" must include protocol. (e.g. \"https://\")")
+        assert not (base_url.startswith('http://') and
+                    'localhost' not in base_url), (
+                    "Connections must use HTTPS (unless using localhost)")
+
+        self.BASE_URL = base_url.rstrip('/')
+
+    def expand_endpoint_url(self, endpoint):
+        """ Return endpoint prepended with base URL """
+        return join_url(self.BASE_URL, endpoint)
+
+    def add_observer(self, observer):
+        """
+        Register a callable to be notified of every request attempt
+        (including retries). Observers are called with the keyword arguments
+        `method`, `url`, `response` (None on connection errors), `error`
+        (None unless a connection error or timeout occurred), `elapsed`
+        (seconds) and `attempt` (0 for the first attempt), and should accept
+        additional keyword arguments.
+        """
+        self.observers.append(observer)
+        return observer
+
+    def _notify_observers(self, method, url, response, error, elapsed,
+                          attempt, **extra):
+        for observer in self.observers:
+            try:
+                observer(method=method, url=url, response=response,
+                         error=error, elapsed=elapsed, attempt=attempt,
+                         **extra)
+            except Exception:
+                logger.exception("Request observer %r failed", observer)
+
+    def flush_keyring(self, username):
+        return keyringlib.delete_password(self.BASE_URL, username)
+
+    def _get_username(self):
+        """ Retrieve username from user input """
+        default_user = getpass.getuser()
+        return (
+            moves.input("Username [{}]: ".format(default_user))
+            or default_user
+        )
+
+    def _get_password(self, username, keyring):
+        """ Retrieve password from keyring or from user input """
+        password = None
+        if keyring:
+            password = keyringlib.get_password(self.BASE_URL, username)
+        if not password:
+            password = getpass.getpass("Password: ")
+            if keyring:
+                keyringlib.set_password(self.BASE_URL, username, password)
+        return password
+
+
+class CadastaSession(BaseSessionMixin, requests.Session):
 
     def __init__(self, base_url='https://platform.cadasta.org',
                  username=None, keyring=True, token=None,
-                 token_keyword='token', raise_for_status=True):
+                 token_keyword='token', raise_for_status=True,
+                 pool_connections=DEFAULT_POOLSIZE,
+                 pool_maxsize=DEFAULT_POOLSIZE, pool_block=False,
+                 keep_alive=True, retry=True, upload_cache=None,
+                 rate_limiter=None, schema_cache=None,
+                 validate_payloads=False, response_cache=None):
         """
         Session to manage authenticating and interacting with the Cadasta API.
 
@@ -37,17 +127,70 @@ class CadastaSession(requests.Session):
             token_keyword (str, optional): Keyword used before token in
                 Authorization header.
             raise_for_status - Throw exception on 400+ level API responses
+            pool_connections (int, optional): Number of host connection pools
+                to cache. Defaults to requests' default (10).
+            pool_maxsize (int, optional): Maximum number of connections kept
+                open per host. Should be at least the number of threads
+                sharing the session, otherwise connections are discarded
+                and re-established. Defaults to requests' default (10).
+            pool_block (bool, optional): Block when no free connection is
+                available in a pool rather than opening a throwaway
+                connection. Defaults to False.
+            keep_alive (bool, optional): Reuse connections between requests.
+                When False, every request asks the server to close its
+                connection. Defaults to True.
+            retry (RetryPolicy or bool, optional): Policy used to retry
+                requests that failed with a connection error or a 429/5xx
+                response. True uses the default `RetryPolicy`, False disables
+                retries. The policy's retry budget is shared by every thread
+                using the session (and by any other session given the same
+                policy). Defaults to True.
+            upload_cache (UploadCache, optional): Cache of uploaded file URLs
+                keyed by content hash. When provided, `upload_file` returns
+                the URL of a previous upload of identical content instead of
+                uploading it again. Defaults to None.
+            rate_limiter (RateLimiter, optional): Read and write request
+                budgets shared by every thread using the session, applied
+                to each request attempt (including retries). Defaults to None.
+            schema_cache (SchemaCache, optional): Cache of the field metadata
+                of endpoints, used by `get_schema` and `validate`. Defaults
+                to an in-memory cache owned by the session.
+            validate_payloads (bool, optional): Validate JSON payloads sent
+                to Party, Location and relationship endpoints against their
+                schema before sending them, raising `ValidationError`
+                rather than making a request bound to fail. Defaults to
+                False.
+            response_cache (ResponseCache, optional): Cache of GET responses
+                carrying an ETag or Last-Modified header. When provided, GET
+                requests for cached URLs are made conditional and a 304
+                response is served from the cache. Defaults to None.
         """
         super(CadastaSession, self).__init__()
 
-        assert (base_url.startswith('https://') or
-                base_url.startswith('http://')), (
-                "\"base_url\" must include protocol. (e.g. \"https://\")")
-        assert not (base_url.startswith('http://') and
-                    'localhost' not in base_url), (
-                    "Connections must use HTTPS (unless using localhost)")
+        self._set_base_url(base_url)
 
-        self.BASE_URL = base_url.rstrip('/')
+        if retry is True:
+            retry = RetryPolicy()
+        self.retry = retry or RetryPolicy(total=0)
+        self.upload_cache = upload_cache
+        self.rate_limiter = rate_limiter
+        self.schemas = (schema_cache if schema_cache is not None
+                        else SchemaCache())
+        self.validate_payloads = validate_payloads
+        self.response_cache = response_cache
+        self.observers = []
+
+        # Connection pooling. S3 uploads go through a separate session so
+        # that they reuse connections without receiving the API's auth
+        # headers.
+        pool_kwargs = dict(pool_connections=pool_connections,
+                           pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.s3_session = requests.Session()
+        for session in (self, self.s3_session):
+            session.mount('https://', HTTPAdapter(**pool_kwargs))
+            session.mount('http://', HTTPAdapter(**pool_kwargs))
+            if not keep_alive:
+                session.headers['Connection'] = 'close'
 
         # Add convenience of only requiring endpoints
         self.get = self._process_req_resp(self.get, raise_for_status)
@@ -68,13 +211,6 @@ class CadastaSession(requests.Session):
         # multi-threaded situations
         self.__fetching_csrf = False
 
-    def __repr__(self):
-        return '<{}>'.format(self.BASE_URL)
-
-    def expand_endpoint_url(self, endpoint):
-        """ Return endpoint prepended with base URL """
-        return join_url(self.BASE_URL, endpoint)
-
     def login(self, username=None, keyring=True):
         """ Login to session """
         username = (username or self._get_username()).lower()
@@ -90,41 +226,36 @@ class CadastaSession(requests.Session):
             raise
         return resp.json()['auth_token']
 
-    def flush_keyring(self, username):
-        return keyringlib.delete_password(self.BASE_URL, username)
-
-    def _get_username(self):
-        """ Retrieve username from user input """
-        default_user = getpass.getuser()
-        return (
-            moves.input("Username [{}]: ".format(default_user))
-            or default_user
-        )
-
-    def _get_password(self, username, keyring):
-        """ Retrieve password from keyring or from user input """
-        password = None
-        if keyring:
-            password = keyringlib.get_password(self.BASE_URL, username)
-        if not password:
-            password = getpass.getpass("Password: ")
-            if keyring:
-                keyringlib.set_password(self.BASE_URL, username, password)
-        return password
+    def close(self):
+        """ Close connection pools of the session and its S3 session """
+        self.s3_session.close()
+        super(CadastaSession, self).close()
 
     def _process_req_resp(self, func, raise_for_status):
         """
         Convenience wrapper to allow user to provide only endpoints to
         HTTP request methods. Additionally, controls if system should
-        throw exceptions on non-200 level responses by default.
+        throw exceptions on non-200 level responses by default and retries
+        failed requests according to the session's retry policy.
 
-        raise_for_status can be overridden at method call.
+        raise_for_status and retry can be overridden at method call.
         """
         @wraps(func)
-        def wrapper(endpoint, raise_for_status=raise_for_status, follow_pagination=False, *args, **kw):
+        def wrapper(endpoint, raise_for_status=raise_for_status, follow_pagination=False, retry=None, prefetch=0, *args, **kw):
             if not endpoint.startswith('http'):
                 endpoint = self.expand_endpoint_url(endpoint)
-            resp = func(endpoint, *args, **kw)
+            if retry is None:
+                retry = self.retry
+            method = func.__name__.upper()
+            if (self.validate_payloads and kw.get('json') is not None and
+                    method in ('POST', 'PUT', 'PATCH') and
+                    resolve(endpoint) in VALIDATED_ENDPOINTS):
+                self.validate(endpoint, kw['json'], method)
+            send = self._send_with_retry
+            if method == 'GET' and self.response_cache is not None:
+                send = self._send_conditional
+            resp = send(
+                func, endpoint, retry or RetryPolicy(total=0), *args, **kw)
             if raise_for_status:
                 try:
                     resp.raise_for_status()
@@ -132,28 +263,178 @@ class CadastaSession(requests.Session):
                     logging.error("RESPONSE: {}".format(resp.text))
                     raise
             if follow_pagination:
-                return self.follow_pagination(resp.json())
+                return self.follow_pagination(resp.json(), prefetch=prefetch)
             return resp
         return wrapper
 
-    def follow_pagination(self, data):
+    def _send_with_retry(self, func, url, policy, *args, **kw):
         """
-        Follow standard paginated response. WARNING: Does not work for
-        paginated GeoJSON response.
+        Send request, retrying connection errors, timeouts and retryable
+        responses with a jittered exponential backoff.
+        """
+        method = func.__name__.upper()
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(method)
+            start = time.time()
+            try:
+                resp = func(url, *args, **kw)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._notify_observers(method, url, None, e,
+                                       time.time() - start, attempt)
+                if not (policy.is_retryable(method, attempt, exc=e) and
+                        policy.consume()):
+                    raise
+                resp = None
+                reason = e.__class__.__name__
+            else:
+                self._notify_observers(method, url, resp, None,
+                                       time.time() - start, attempt)
+                if not (policy.is_retryable(method, attempt, resp=resp) and
+                        policy.consume()):
+                    return resp
+                reason = resp.status_code
+                resp.close()
+            delay = policy.get_backoff(attempt, resp)
+            attempt += 1
+            logger.warning("%s %s failed (%s), retry %d in %.2fs",
+                           method, url, reason, attempt, delay)
+            time.sleep(delay)
+
+    def _send_conditional(self, func, url, policy, *args, **kw):
+        """
+        Send GET request revalidating the cached response of the URL, if any,
+        and serve the cached response if the server replies 304 Not Modified.
+        Cache the response otherwise, if it carries validators.
+        """
+        cache = self.response_cache
+        prepared = requests.PreparedRequest()
+        prepared.prepare_url(url, kw.get('params'))
+        key = prepared.url
+        cached = cache.get(key)
+        if cached is not None:
+            kw['headers'] = dict(kw.get('headers') or {},
+                                 **cache.conditional_headers(cached[0]))
+        resp = self._send_with_retry(func, url, policy, *args, **kw)
+        if resp.status_code == 304 and cached is not None:
+            headers, content = cached
+            resp = _cached_response(resp, headers, content)
+            if any(resp.headers.get(h) != _get_header(headers, h)
+                   for h in _VALIDATORS):
+                cache.set(key, resp.headers, content)
+        elif resp.status_code == 200 and any(
+                h in resp.headers for h in _VALIDATORS):
+            cache.set(key, resp.headers, resp.content)
+        return resp
+
+    def follow_pagination(self, data, prefetch=0):
+        """
+        Follow standard paginated response. Paginated GeoJSON responses are
+        handed to `follow_geojson_pagination`.
+
+        Args:
+            data (dict): First page of the paginated response.
+            prefetch (int, optional): Number of pages to fetch in background
+                threads while the current page is being consumed. If the
+                'next' URL exposes its position ('page' or 'offset' query
+                parameters) and the response includes a 'count', up to this
+                many pages are fetched concurrently. Otherwise only the next
+                page is fetched ahead. At most `prefetch` pages are held in
+                memory in addition to the current page. Defaults to 0 (fetch
+                each page only once the previous one has been consumed).
         """
         assert isinstance(data, dict), (
             "Malformed response payload. Expected 'dict', got "
             "{!r}".format(type(data)))
+        if _get_features(data) is not None:
+            for feature in self.follow_geojson_pagination(data, prefetch):
+                yield feature
+            return
         assert 'next' in data, (
             "Malformed response payload. Missing 'next' key.")
         assert 'results' in data, (
             "Malformed response payload. Missing 'result' key.")
-        while True:
-            for r in data['results']:
+        for page in self._iter_pages(data, len(data['results']), prefetch):
+            for r in page['results']:
                 yield r
-            if not data['next']:
-                break
-            data = self.get(data['next']).json()
+
+    def follow_geojson_pagination(self, data, prefetch=0):
+        """
+        Follow paginated GeoJSON response, lazily yielding its Features.
+        Supports FeatureCollections with top-level pagination keys ('count',
+        'next', 'features'), FeatureCollections nested within the 'results'
+        of a standard paginated response, and unpaginated FeatureCollections.
+
+        Args:
+            data (dict): First page of the paginated response.
+            prefetch (int, optional): Number of pages to fetch ahead. See
+                `follow_pagination`. Defaults to 0.
+        """
+        features = _get_features(data)
+        assert features is not None, (
+            "Malformed response payload. Expected a FeatureCollection.")
+        if not data.get('next'):
+            for feature in features:
+                yield feature
+            return
+        for page in self._iter_pages(data, len(features), prefetch):
+            for feature in _get_features(page):
+                yield feature
+
+    def download_features(self, endpoint, path, prefetch=0):
+        """
+        Stream all Features of a (paginated) GeoJSON endpoint to a
+        newline-delimited GeoJSON file, one Feature per line, without
+        holding the whole FeatureCollection in memory. Returns the number of
+        Features written.
+        """
+        features = self.get(endpoint, follow_pagination=True,
+                            prefetch=prefetch)
+        count = 0
+        with open(path, 'w') as f:
+            for feature in features:
+                f.write(json.dumps(feature, separators=(',', ':')))
+                f.write('\n')
+                count += 1
+        return count
+
+    def _iter_pages(self, data, page_size, prefetch=0):
+        """
+        Yield pages of a paginated response, starting with the provided
+        page, optionally prefetching upcoming pages in background threads.
+        """
+        if not prefetch:
+            while True:
+                yield data
+                if not data['next']:
+                    return
+                data = self.get(data['next']).json()
+
+        urls = None
+        if data['next'] and data.get('count'):
+            urls = _page_urls(data['next'], data['count'], page_size)
+        pool = ThreadPool(prefetch)
+        pending = deque()
+        try:
+            while True:
+                if urls is not None:
+                    for url in urls:
+                        pending.append(pool.apply_async(self._get_json, (url,)))
+                        if len(pending) >= prefetch:
+                            break
+                elif data['next'] and not pending:
+                    pending.append(
+                        pool.apply_async(self._get_json, (data['next'],)))
+                yield data
+                if not pending:
+                    return
+                data = pending.popleft().get()
+        finally:
+            pool.terminate()
+
+    def _get_json(self, url):
+        return self.get(url).json()
 
     def get_csrf(self):
         """
@@ -180,14 +461,19 @@ class CadastaSession(requests.Session):
         assert self.cookies.get('csrftoken'), "No CSRF token found in cookie"
         return self.cookies['csrftoken']
 
-    def upload_file(self, file_path, upload_to=None):
-        """ Upload file a provided path to S3. Returns URL of uploaded file """
-        headers = {
+    def _csrf_headers(self):
+        return {
                 'Referer': self.BASE_URL,
                 'X-CSRFToken': self.get_csrf(),
                 'content-type': 'application/x-www-form-urlencoded',
         }
-        key = file_path.split('/')[-1]
+
+    def get_upload_policy(self, filename, upload_to=None):
+        """
+        Request a signed policy (a dict of 'url' and form 'fields') allowing
+        to upload a file with the provided name to S3.
+        """
+        key = filename
         # HACK: If the model that will store this file has an `upload_to`
         # property on its `S3FileField`, it's important that the key fit with
         # this declaration so that the file may be opened by the system in the
@@ -195,45 +481,224 @@ class CadastaSession(requests.Session):
         # `upload_to` location)
         if upload_to:
             key = upload_to + '/' + key
-        policy = self.post(
+        return self.post(
             S3_UPLOAD,
             data={'key': key},
-            headers=headers,
+            headers=self._csrf_headers(),
         ).json()
 
+    def upload_with_policy(self, policy, file_path, filename=None, size=None,
+                           progress=None, chunk_size=64 * 1024):
+        """
+        Upload file to S3 with a policy from `get_upload_policy`. Returns URL
+        of uploaded file. See `upload_file` for the other arguments.
+        """
+        is_path = isinstance(file_path, string_types)
+        if is_path:
+            filename = filename or os.path.basename(file_path)
+        else:
+            assert filename, (
+                "A filename is required to upload a file-like object")
+            if size is None and hasattr(file_path, '__len__'):
+                size = len(file_path)
+
         # HACK: When the Cadasta platform is running in 'dev' mode,
         # Django-Buckets returns a policy['url'] in a relative form
         # ('/media/s3/uploads'). This should be fixed on the Django-Buckets
         # library, however in the meantime this is a workaround:
-        global requests
-        if policy['url'].startswith('/'):
-            requests = self
-            policy['url'] = (self.BASE_URL + policy['url'])  # TODO: Rm after https://github.com/Cadasta/django-buckets/pull/22
-        resp = requests.post(
-            policy['url'],
-            data=policy['fields'],
-            files={'file': open(file_path, 'rb')},
-            headers={
-                k: v if k != 'content-type' else None
-                for k, v in headers.items()
-            } if self == requests else {}  # HACK: Django-buckets CSRF work-around, rm after https://github.com/Cadasta/django-buckets/pull/24 # noqa
-        )
+        session = self.s3_session
+        url = policy['url']
+        if url.startswith('/'):
+            session = self
+            url = (self.BASE_URL + url)  # TODO: Rm after https://github.com/Cadasta/django-buckets/pull/22
+        if is_path:
+            f = open(file_path, 'rb')
+        elif hasattr(file_path, 'read'):
+            f = file_path
+        else:
+            f = IterReader(file_path)
+        try:
+            body = MultipartEncoder(
+                policy['fields'], 'file', f, filename, size=size,
+                chunk_size=chunk_size, callback=progress)
+            upload_headers = {'content-type': body.content_type}
+            if session is self:  # HACK: Django-buckets CSRF work-around, rm after https://github.com/Cadasta/django-buckets/pull/24 # noqa
+                upload_headers = dict(self._csrf_headers(), **upload_headers)
+            start = time.time()
+            resp = session.post(
+                url,
+                data=body,
+                headers=upload_headers,
+            )
+            if session is self.s3_session:
+                self._notify_observers('POST', url, resp, None,
+                                       time.time() - start, 0,
+                                       template='S3_BUCKET')
+        finally:
+            if is_path:
+                f.close()
         if not resp.ok:
             logging.error("RESPONSE: {}".format(resp.text))
             resp.raise_for_status()
-        return join_url(policy['url'], policy['fields']['key'])
+        return join_url(url, policy['fields']['key'])
+
+    def _cached_upload(self, file_path, upload_to):
+        """
+        Return content digest of a file and the URL it was previously
+        uploaded to (or None), or (None, None) if uploads aren't cached.
+        """
+        if self.upload_cache is None or not isinstance(file_path,
+                                                       string_types):
+            return None, None
+        digest = file_hash(file_path)
+        file_url = self.upload_cache.get(self.BASE_URL, upload_to, digest)
+        if file_url:
+            logger.debug("Skipping upload of %r, already uploaded to %r",
+                         file_path, file_url)
+        return digest, file_url
+
+    def upload_file(self, file_path, upload_to=None, progress=None,
+                    chunk_size=64 * 1024, filename=None, size=None):
+        """
+        Upload file a provided path to S3. Returns URL of uploaded file. The
+        file is streamed from disk in chunks of `chunk_size` bytes rather than
+        loaded into memory. If provided, `progress` is called with the number
+        of bytes sent so far and the total size of the request body.
+
+        Rather than a path, `file_path` may be a file-like object (e.g. a
+        `fs.ZipStream` archive built on the fly) or an iterable of bytes
+        chunks, streamed the same way. These require a `filename` and, if
+        their length can't be taken with `len()` (or from their file
+        descriptor), a `size`.
+
+        If the session has an upload cache and content identical to the file
+        has already been uploaded to the same `upload_to` location, the URL
+        of that upload is returned without uploading the file. Only files
+        provided by path are cached.
+        """
+        digest, file_url = self._cached_upload(file_path, upload_to)
+        if file_url:
+            return file_url
+        if filename is None and isinstance(file_path, string_types):
+            filename = os.path.basename(file_path)
+        policy = self.get_upload_policy(filename, upload_to)
+        file_url = self.upload_with_policy(
+            policy, file_path, filename=filename, size=size,
+            progress=progress, chunk_size=chunk_size)
+        if digest is not None:
+            self.upload_cache.set(self.BASE_URL, upload_to, digest, file_url)
+        return file_url
+
+    def create_resources(self, endpoint, files, upload_to='resources',
+                         workers=8, batch_size=100):
+        """
+        Upload many files and create Resources from them, attached to a
+        single Party, Location or relationship. Yields a `ResourceResult`
+        per file, in the order of `files`:
+
+            url = endpoints.party_resources(org_slug, proj_slug, party_id)
+            for result in cnxn.create_resources(url, paths):
+                if result.error:
+                    logger.error("Failed %s: %s", result.file, result.error)
+
+        Files are handled in batches. The signed upload policies of a batch
+        are requested concurrently up front, then files are uploaded
+        concurrently, each Resource being created as soon as its file is
+        uploaded. A failure only fails its own file.
+
+        Args:
+            endpoint (str): Resources endpoint of the parent (e.g.
+                `endpoints.party_resources(...)`,
+                `endpoints.location_resources(...)` or
+                `endpoints.tenure_relationship_resources(...)`).
+            files (iterable): Paths of files, or dicts of Resource fields
+                with the path of the file under 'file' (e.g. to set a
+                'name' or 'description').
+            upload_to (str, optional): See `get_upload_policy`. Defaults to
+                'resources', as used by the platform's Resource model.
+            workers (int, optional): Number of files handled concurrently.
+                Defaults to 8.
+            batch_size (int, optional): Number of files per batch. Defaults
+                to 100.
+        """
+        def fetch_policy(item):
+            try:
+                digest, file_url = self._cached_upload(item['file'],
+                                                       upload_to)
+                if file_url:
+                    return digest, file_url, None
+                policy = self.get_upload_policy(
+                    os.path.basename(item['file']), upload_to)
+                return digest, None, policy
+            except Exception as e:
+                return e
+
+        def upload_and_create(args):
+            item, prepared = args
+            if isinstance(prepared, Exception):
+                return ResourceResult(item['file'], None, prepared)
+            digest, file_url, policy = prepared
+            try:
+                if not file_url:
+                    file_url = self.upload_with_policy(policy, item['file'])
+                    if digest is not None:
+                        self.upload_cache.set(self.BASE_URL, upload_to,
+                                              digest, file_url)
+                data = _resource_data(item, file_url)
+                resource = self.post(endpoint, json=data).json()
+            except Exception as e:
+                logger.warning("Unable to create resource from %r: %s",
+                               item['file'], e)
+                return ResourceResult(item['file'], None, e)
+            return ResourceResult(item['file'], resource, None)
+
+        files = iter(files)
+        pool = ThreadPool(workers)
+        try:
+            while True:
+                batch = [f if isinstance(f, dict) else {'file': f}
+                         for f in islice(files, batch_size)]
+                if not batch:
+                    return
+                prepared = pool.map(fetch_policy, batch)
+                for result in pool.imap(upload_and_create,
+                                        zip(batch, prepared)):
+                    yield result
+        finally:
+            pool.terminate()
+
+    def get_schema(self, endpoint, verb='POST'):
+        """
+        Return metadata of the fields accepted by an endpoint for a verb,
+        from the session's schema cache.
+        """
+        actions = self.schemas.get(self, endpoint)
+        assert actions, ("No actions defined by API. "
+                         "Likely a read-only endpoint.")
+        # Detail endpoints share the schema of their collection
+        if verb not in actions and verb in ('PUT', 'PATCH'):
+            verb = 'PUT' if 'PUT' in actions else 'POST'
+        return actions[verb]
+
+    def validate(self, endpoint, payload, verb='POST'):
+        """
+        Check payload against the schema of an endpoint (see
+        `schema.validate`) without sending it, raising `ValidationError` if
+        it is invalid. GeoJSON Features are validated by their properties.
+        """
+        errors = validate(self.get_schema(endpoint, verb), payload,
+                          partial=verb == 'PATCH')
+        if errors:
+            raise ValidationError(endpoint, errors)
 
     def describe_field_requirements(self, endpoint, verb='POST'):
         """
         Print field information required for POSTing data
         """
-        resp = self.options(endpoint).json()
-        assert 'actions' in resp, ("No actions defined by API. "
-                                   "Likely a read-only endpoint.")
         required = []
         optional = []
         read_only = []
-        for field, metadata in resp['actions'][verb].items():
+        for field, metadata in self.get_schema(endpoint, verb).items():
             f = {field: metadata}
             if metadata['required']:
                 required.append(f)
@@ -250,3 +715,88 @@ class CadastaSession(requests.Session):
             if data:
                 print(yaml.safe_dump(
                     {name.upper(): data}, default_flow_style=False))
+
+
+def _page_urls(next_url, count, page_size):
+    """
+    Given the 'next' URL of the first page of a paginated response, the total
+    item count and the size of the first page, return an iterator over the
+    URLs of all remaining pages. Returns None if the URL does not expose
+    its position.
+    """
+    scheme, netloc, path, query, fragment = urlsplit(next_url)
+    params = parse_qs(query)
+
+    def build(**updates):
+        params.update((k, [str(v)]) for k, v in updates.items())
+        return urlunsplit((scheme, netloc, path, urlencode(params, doseq=True),
+                           fragment))
+
+    try:
+        if 'page' in params:
+            page_size = int(params.get('page_size', [page_size])[0])
+            start = int(params['page'][0])
+            last = int(math.ceil(float(count) / page_size))
+            return (build(page=p) for p in range(start, last + 1))
+        if 'offset' in params:
+            limit = int(params.get('limit', [page_size])[0])
+            start = int(params['offset'][0])
+            return (build(offset=o) for o in range(start, count, limit))
+    except (ValueError, ZeroDivisionError):
+        pass
+    return None
+
+
+def _get_features(data):
+    """
+    Return the Features of a GeoJSON FeatureCollection response, which may
+    be nested within the 'results' of a paginated response. Returns None if
+    the response is not a FeatureCollection.
+    """
+    for collection in (data, data.get('results')):
+        if (isinstance(collection, dict) and
+                collection.get('type') == 'FeatureCollection'):
+            return collection.get('features', [])
+    return None
+
+
+_VALIDATORS = ('ETag', 'Last-Modified')
+
+
+def _cached_response(not_modified, headers, content):
+    """
+    Return cached response rebuilt from a 304 Not Modified response, with
+    its headers refreshed by those of the 304 response. It is flagged with a
+    `from_cache` attribute.
+    """
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.reason = 'OK'
+    resp._content = content
+    resp.headers = requests.structures.CaseInsensitiveDict(headers)
+    for header in _VALIDATORS + ('Cache-Control', 'Date', 'Expires'):
+        if header in not_modified.headers:
+            resp.headers[header] = not_modified.headers[header]
+    resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+    resp.url = not_modified.url
+    resp.request = not_modified.request
+    resp.elapsed = not_modified.elapsed
+    resp.history = not_modified.history
+    resp.connection = not_modified.connection
+    resp.from_cache = True
+    return resp
+
+
+def _resource_data(item, file_url):
+    """ Return Resource fields of a file uploaded to file_url """
+    data = dict(item)
+    path = data.pop('file')
+    original_file = os.path.basename(path)
+    data['file'] = file_url
+    data.setdefault('original_file', original_file)
+    data.setdefault('name', original_file.split('.')[0])
+    mime_type = get_mime_type(path)
+    if mime_type and 'zip' not in mime_type:
+        # FIXME: Zip mimetypes not currently supported.
+        data.setdefault('mime_type', mime_type)
+    return data
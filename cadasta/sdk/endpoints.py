@@ -1,3 +1,8 @@
+import re
+
+from six.moves.urllib.parse import urlsplit
+
+
 def join_url(*fragments):
     url = '/'.join(f.strip('/') for f in fragments if f)
     if not url.startswith('http'):
@@ -73,6 +78,14 @@ def tenure_relationships(org_slug, proj_slug, tenure_rel_id=None):
     return join_url(projects(org_slug, proj_slug), 'relationships', 'tenure', tenure_rel_id)
 
 
+def tenure_relationship_resources(org_slug, proj_slug, tenure_rel_id,
+                                  resource_id=None):
+    """
+    /api/v1/organizations/<organization>/projects/<project>/relationships/tenure/{tenure_rel_id}/resources/{resource_id}
+    """
+    return join_url(tenure_relationships(org_slug, proj_slug, tenure_rel_id), 'resources', resource_id)
+
+
 def resources(org_slug, proj_slug, resource_id=None):
     """
     /api/v1/organizations/<organization>/projects/<project>/resource_ids/{resource}
@@ -92,6 +105,44 @@ def location_resources(org_slug, proj_slug, location_id, resource_id=None):
     """
     return join_url(locations(org_slug, proj_slug, location_id), 'resources', resource_id)
 
+
+_SEGMENT = '[^/]+'
+_PROJECT = '/api/v1/organizations/{0}/projects/{0}/'.format(_SEGMENT)
+_TEMPLATE_PATTERNS = (
+    ('LOGIN', '^/api/v1/account/login/$'),
+    ('S3_UPLOAD', '^/s3/signed-url/$'),
+    ('orgs', '^/api/v1/organizations/({s}/)?$'),
+    ('projects', '^/api/v1/organizations/{s}/projects/({s}/)?$'),
+    ('parties', '^{p}parties/({s}/)?$'),
+    ('party_relationships', '^{p}parties/{s}/relationships/$'),
+    ('party_resources', '^{p}parties/{s}/resources/({s}/)?$'),
+    ('questionnaire', '^{p}questionnaire/$'),
+    ('spatial_relationships', '^{p}relationships/spatial/({s}/)?$'),
+    ('tenure_relationships', '^{p}relationships/tenure/({s}/)?$'),
+    ('tenure_relationship_resources',
+     '^{p}relationships/tenure/{s}/resources/({s}/)?$'),
+    ('resources', '^{p}resources/({s}/)?$'),
+    ('locations', '^{p}spatial/({s}/)?$'),
+    ('location_resources', '^{p}spatial/{s}/resources/({s}/)?$'),
+)
+_TEMPLATES = [(name, re.compile(pattern.format(s=_SEGMENT, p=_PROJECT)))
+              for name, pattern in _TEMPLATE_PATTERNS]
+
+
+def resolve(url):
+    """
+    Return the name of the endpoint (e.g. 'parties', 'S3_UPLOAD') matching
+    a URL or endpoint, or None if it matches none of the known endpoints.
+    """
+    path = urlsplit(url).path
+    if not path.endswith('/'):
+        path += '/'
+    for name, pattern in _TEMPLATES:
+        if pattern.match(path):
+            return name
+    return None
+
+
 # TODO:
 # /api/v1/organizations/<organization>/projects/<project>/spatial/<location>/relationships/
 # /api/v1/organizations/<organization>/projects/<project>/spatial/<location>/resources/
@@ -0,0 +1,285 @@
+import json
+import os
+import threading
+import time
+
+from six.moves.urllib.parse import urlsplit
+
+from . import endpoints
+
+__all__ = ('EntityCache',)
+
+
+def _path(url):
+    """ Path of a URL or endpoint, with a trailing slash """
+    path = urlsplit(url).path
+    return path if path.endswith('/') else path + '/'
+
+
+def _entity_id(entity):
+    """ ID of an entity, or of a GeoJSON Feature """
+    if entity.get('type') == 'Feature' and 'properties' in entity:
+        return entity['properties'].get('id')
+    return entity.get('id')
+
+
+class _Collection(object):
+    """ Entities of a list endpoint, indexed by ID, name and slug """
+
+    def __init__(self, path, entities=(), loaded_at=None):
+        self.path = path
+        self.loaded_at = time.time() if loaded_at is None else loaded_at
+        self._by_id = {}
+        self._by_name = {}
+        self._by_slug = {}
+        for entity in entities:
+            self.add(entity)
+
+    def __repr__(self):
+        return '<{} {!r} size={}>'.format(
+            self.__class__.__name__, self.path, len(self))
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key):
+        """ Return entity by ID, or by slug, or None """
+        entity = self._by_id.get(key)
+        if entity is None:
+            entity = self._by_slug.get(key)
+        return entity
+
+    def by_name(self, name):
+        """ Return list of entities with a name """
+        return list(self._by_name.get(name, ()))
+
+    def add(self, entity):
+        """ Add entity, or replace the entity with the same ID """
+        self.remove(_entity_id(entity))
+        self._by_id[_entity_id(entity)] = entity
+        name = entity.get('name')
+        if name is not None:
+            self._by_name.setdefault(name, []).append(entity)
+        slug = entity.get('slug')
+        if slug is not None:
+            self._by_slug[slug] = entity
+
+    def remove(self, key):
+        """ Remove entity by ID or slug """
+        entity = self.get(key)
+        if entity is None:
+            return
+        del self._by_id[_entity_id(entity)]
+        name = entity.get('name')
+        if name is not None:
+            self._by_name[name].remove(entity)
+            if not self._by_name[name]:
+                del self._by_name[name]
+        if entity.get('slug') is not None:
+            self._by_slug.pop(entity['slug'], None)
+
+
+class EntityCache(object):
+
+    def __init__(self, session, path=None, ttl=None, prefetch=0):
+        """
+        Local read-through cache of the Organizations, Projects, Parties,
+        Locations and relationships behind list endpoints. A list is loaded
+        once, following its pagination, then entities are looked up by ID,
+        slug or name without further requests:
+
+            entities = EntityCache(cnxn)
+            parties = entities.parties(org_slug, proj_slug)
+            matches = parties.by_name('John Smith')
+            if endpoints.projects(org_slug, proj_slug) in entities:
+                ...
+
+        The cache observes the session it is created with: objects created,
+        updated or deleted through the session (POST, PUT, PATCH or DELETE)
+        are updated in already loaded lists, so they stay accurate without
+        being reloaded. Safe to share between threads.
+
+        Args:
+            session (CadastaSession): Session used to load lists, whose
+                requests are observed.
+            path (str, optional): JSON file the cache is persisted to, so that
+                lists are reused between runs. Written when a list is loaded
+                and on `save()`. Defaults to None (memory only).
+            ttl (float, optional): Number of seconds after which a list is
+                loaded again. Defaults to None (never).
+            prefetch (int, optional): Number of pages fetched concurrently
+                when loading a list (see `CadastaSession.follow_pagination`).
+                Defaults to 0.
+        """
+        self.session = session
+        self.path = path
+        self.ttl = ttl
+        self.prefetch = prefetch
+        self._lock = threading.RLock()
+        self._load_locks = {}  # Held while loading a list
+        self._loading = {}  # Requests observed while loading, by list path
+        self._collections = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for col_path, data in json.load(f).items():
+                    self._collections[col_path] = _Collection(
+                        col_path, data['entities'], data['loaded_at'])
+        session.add_observer(self)
+
+    def __repr__(self):
+        return '<{} {!r} collections={}>'.format(
+            self.__class__.__name__, self.path, len(self._collections))
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    def collection(self, endpoint):
+        """ Return entities of a list endpoint, loading them if needed """
+        path = _path(endpoint)
+        with self._lock:
+            col = self._fresh(path)
+            if col is not None:
+                return col
+            load_lock = self._load_locks.setdefault(path, threading.Lock())
+        # Loading a list can take long: only hold the cache's lock to install
+        # it, so that other lists and the observer aren't blocked meanwhile
+        with load_lock:
+            with self._lock:
+                col = self._fresh(path)
+                if col is not None:
+                    return col
+                self._loading[path] = []
+            try:
+                data = self.session.get(path).json()
+                # Some lists (e.g. Organizations) aren't paginated
+                if isinstance(data, dict):
+                    data = list(self.session.follow_pagination(
+                        data, prefetch=self.prefetch))
+                col = _Collection(path, data)
+            finally:
+                with self._lock:
+                    observed = self._loading.pop(path)
+            with self._lock:
+                self._collections[path] = col
+                # Apply changes made while loading, which the list may not
+                # reflect
+                for args, kwargs in observed:
+                    self(*args, **kwargs)
+                self._save()
+            return col
+
+    def _fresh(self, path):
+        col = self._collections.get(path)
+        if col is None or (self.ttl is not None and
+                           time.time() - col.loaded_at > self.ttl):
+            return None
+        return col
+
+    def get(self, url):
+        """
+        Return entity of a detail endpoint (e.g.
+        `endpoints.parties(org_slug, proj_slug, party_id)`, or a Project's
+        endpoint by slug) from its list, or None if it doesn't exist.
+        """
+        parent, key = _split_detail(url)
+        if key is None:
+            return None
+        return self.collection(parent).get(key)
+
+    def orgs(self):
+        return self.collection(endpoints.orgs())
+
+    def projects(self, org_slug):
+        return self.collection(endpoints.projects(org_slug))
+
+    def parties(self, org_slug, proj_slug):
+        return self.collection(endpoints.parties(org_slug, proj_slug))
+
+    def locations(self, org_slug, proj_slug):
+        return self.collection(endpoints.locations(org_slug, proj_slug))
+
+    def tenure_relationships(self, org_slug, proj_slug):
+        return self.collection(
+            endpoints.tenure_relationships(org_slug, proj_slug))
+
+    def spatial_relationships(self, org_slug, proj_slug):
+        return self.collection(
+            endpoints.spatial_relationships(org_slug, proj_slug))
+
+    def invalidate(self, endpoint=None):
+        """ Forget entities of a list endpoint, or of all lists """
+        with self._lock:
+            if endpoint is None:
+                self._collections = {}
+            else:
+                self._collections.pop(_path(endpoint), None)
+            self._save()
+
+    def __call__(self, method, url, response=None, error=None, **kwargs):
+        """ Update loaded lists with the outcome of a session's request """
+        if (method not in ('POST', 'PUT', 'PATCH', 'DELETE') or
+                response is None or not response.ok):
+            return
+        path = _path(url)
+        with self._lock:
+            parent = path if method == 'POST' else _split_detail(path)[0]
+            if parent in self._loading:
+                self._loading[parent].append(
+                    ((method, url), {'response': response}))
+            if method == 'POST':
+                col = self._collections.get(path)
+                if col is not None:
+                    self._add(col, response)
+                return
+            parent, key = _split_detail(path)
+            col = self._collections.get(parent) if key else None
+            if col is None:
+                return
+            if method == 'DELETE':
+                col.remove(key)
+            else:
+                self._add(col, response)
+
+    def _add(self, col, response):
+        try:
+            entity = response.json()
+        except ValueError:
+            return
+        if isinstance(entity, dict) and _entity_id(entity) is not None:
+            col.add(entity)
+
+    def save(self):
+        """ Persist the cache, if it has a path """
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        data = dict((path, {'loaded_at': col.loaded_at,
+                            'entities': list(col)})
+                    for path, col in self._collections.items())
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        getattr(os, 'replace', os.rename)(tmp_path, self.path)
+
+
+def _split_detail(url):
+    """
+    Split a detail endpoint into the path of its list endpoint and the ID
+    or slug of the entity, or return (path, None) if not a detail endpoint
+    """
+    path = _path(url)
+    parent, key = path.rstrip('/').rsplit('/', 1)
+    parent += '/'
+    name = endpoints.resolve(path)
+    if name is None or endpoints.resolve(parent) != name:
+        return path, None
+    return parent, key
@@ -1,6 +1,61 @@
+from fnmatch import fnmatch
 from tempfile import mkdtemp
+import hashlib
+import logging
 import os
 import shutil
+import struct
+import threading
+import time
+import zlib
+
+from six.moves import queue
+
+try:
+    from os import scandir
+except ImportError:  # Python < 3.5
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+logger = logging.getLogger(__name__)
+
+
+class _DirEntry(object):
+    """ Minimal `os.DirEntry` stand-in, used without scandir """
+
+    def __init__(self, dir_path, name):
+        self.name = name
+        self.path = os.path.join(dir_path, name)
+
+    def is_dir(self, follow_symlinks=True):
+        if not follow_symlinks and os.path.islink(self.path):
+            return False
+        return os.path.isdir(self.path)
+
+    def is_file(self, follow_symlinks=True):
+        if not follow_symlinks and os.path.islink(self.path):
+            return False
+        return os.path.isfile(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+
+def _scandir(path):
+    """
+    Return list of entries of a directory. Where supported, entries carry the
+    file type read along with the directory, saving a stat call per entry.
+    """
+    if scandir is None:
+        return [_DirEntry(path, name) for name in os.listdir(path)]
+    it = scandir(path)
+    try:
+        return list(it)
+    finally:
+        if hasattr(it, 'close'):
+            it.close()
 
 
 def ls(path, isfile=None):
@@ -12,11 +67,11 @@ def ls(path, isfile=None):
         non-files (directories). Defaults to None, showing both hidden and
         not-hidden.
     """
-    for file in os.listdir(path):
+    for entry in _scandir(path):
         if (isfile is not None):
-            if not os.path.isfile(os.path.join(path, file)) == isfile:
+            if not entry.is_file() == isfile:
                 continue
-        yield os.path.join(path, file)
+        yield entry.path
 
 
 def ls_dirs(path):
@@ -41,6 +96,291 @@ def ls_files(path, hidden=None):
         yield f
 
 
+def walk(path, patterns=None, extensions=None, recursive=True,
+         files=True, dirs=False, hidden=True, follow_symlinks=False,
+         threads=1, maxsize=1000):
+    """
+    Yield `os.DirEntry` of files (and/or directories) below a provided path,
+    as they are found. Entries are read with `os.scandir`, whose cached type
+    information avoids a stat call per entry (costly on network file
+    systems).
+
+    With more than one thread, directories are read concurrently and entries
+    are yielded in no particular order:
+
+        for entry in fs.walk(data_dir, extensions=('.shp',), threads=16):
+            print(entry.path)
+
+    Args:
+        path (str): Directory to walk.
+        patterns (iterable, optional): Only yield entries whose name matches
+            one of these glob patterns (e.g. '*.jp*g').
+        extensions (iterable, optional): Only yield entries whose name ends
+            with one of these extensions (e.g. '.shp'), case-insensitively.
+        recursive (bool, optional): Descend into subdirectories. Defaults to
+            True.
+        files (bool, optional): Yield files. Defaults to True.
+        dirs (bool, optional): Yield directories. Defaults to False.
+        hidden (bool, optional): Yield, and descend into, entries whose name
+            begins with a period ('.'). Defaults to True.
+        follow_symlinks (bool, optional): Descend into (and yield, with
+            `dirs`) symlinked directories. Defaults to False, skipping
+            them.
+        threads (int, optional): Number of threads reading directories.
+            Defaults to 1 (read in the calling thread, depth-first).
+        maxsize (int, optional): Maximum number of directories read ahead of
+            the consumer when threaded. Defaults to 1000.
+    """
+    if extensions is not None:
+        extensions = tuple(e.lower() for e in extensions)
+
+    def select(entries):
+        """ Split entries into those to yield and directories to walk """
+        selected, subdirs = [], []
+        for entry in entries:
+            if not hidden and entry.name.startswith('.'):
+                continue
+            # Symlinked directories are skipped unless followed, while
+            # symlinked files are yielded like files (unless broken)
+            if entry.is_dir(follow_symlinks=follow_symlinks):
+                if recursive:
+                    subdirs.append(entry.path)
+                if not dirs:
+                    continue
+            elif entry.is_file():
+                if not files:
+                    continue
+            else:
+                continue
+            if (extensions is not None and
+                    not entry.name.lower().endswith(extensions)):
+                continue
+            if (patterns is not None and
+                    not any(fnmatch(entry.name, p) for p in patterns)):
+                continue
+            selected.append(entry)
+        return selected, subdirs
+
+    def read(dir_path):
+        try:
+            return select(_scandir(dir_path))
+        except OSError as e:
+            logger.warning("Unable to read directory %r: %s", dir_path, e)
+            return [], []
+
+    if threads <= 1:
+        stack = [path]
+        while stack:
+            selected, subdirs = read(stack.pop())
+            for entry in selected:
+                yield entry
+            stack.extend(reversed(subdirs))
+        return
+
+    for entry in _walk_threaded(path, read, threads, maxsize):
+        yield entry
+
+
+def _walk_threaded(path, read, threads, maxsize):
+    pending = queue.Queue()
+    found = queue.Queue(maxsize)
+    stop = threading.Event()
+    done = object()
+    lock = threading.Lock()
+    state = {'remaining': 1}  # Directories queued or being read
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                return found.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+
+    def worker():
+        while not stop.is_set():
+            try:
+                dir_path = pending.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            selected, subdirs = read(dir_path)
+            if selected:
+                put(selected)
+            with lock:
+                state['remaining'] += len(subdirs) - 1
+                finished = not state['remaining']
+            for subdir in subdirs:
+                pending.put(subdir)
+            if finished:
+                put(done)
+
+    pending.put(path)
+    workers = [threading.Thread(target=worker, name='walk-{}'.format(i))
+               for i in range(threads)]
+    for t in workers:
+        t.daemon = True
+        t.start()
+    try:
+        while True:
+            entries = found.get()
+            if entries is done:
+                return
+            for entry in entries:
+                yield entry
+    finally:
+        stop.set()
+        for t in workers:
+            t.join()
+
+
+def file_hash(path, algorithm='sha256', chunk_size=1024 * 1024):
+    """
+    Return hex digest of a file's content, reading the file in chunks.
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ZipStream(object):
+    """
+    File-like object streaming an uncompressed (ZIP_STORED) zip archive of
+    files, read from disk in chunks as the archive is consumed. Nothing is
+    staged on disk and memory use doesn't depend on the size of the files.
+    As entries are stored uncompressed, the length of the archive is known
+    up front, so it can be uploaded with a Content-Length:
+
+        archive = fs.ZipStream(['parcels.shp', 'parcels.dbf', 'parcels.shx'])
+        file_url = cnxn.upload_file(archive, filename='parcels.shp.zip')
+
+    Each file's CRC-32 checksum is computed just before the file is
+    streamed, so that it is written along with the file's size in the local
+    header as well as in the central directory, and the archive can be read
+    by streaming unzip implementations. Files are therefore read twice, and
+    must not change in the meantime. Archives are limited to 4 GiB.
+    """
+
+    def __init__(self, paths, arcnames=None, chunk_size=64 * 1024):
+        """
+        Args:
+            paths (iterable): Paths of files to archive.
+            arcnames (iterable, optional): Names of the files within the
+                archive. Defaults to the basenames of the paths.
+            chunk_size (int, optional): Number of bytes read at once when no
+                size is given to `read()`. Defaults to 64 KiB.
+        """
+        paths = list(paths)
+        if arcnames is None:
+            arcnames = [os.path.basename(p) for p in paths]
+        self.chunk_size = chunk_size
+        self._entries = []
+        offset = 0
+        for path, arcname in zip(paths, arcnames):
+            st = os.stat(path)
+            name = arcname.encode('utf-8')
+            flags = 0
+            if len(name) != len(arcname):
+                flags |= 0x800  # UTF-8 name
+            entry = {
+                'path': path,
+                'name': name,
+                'size': st.st_size,
+                'offset': offset,
+                'dostime': _dos_time(st.st_mtime),
+                'flags': flags,
+                'crc': 0,
+            }
+            self._entries.append(entry)
+            offset += 30 + len(name) + st.st_size
+        self._cd_offset = offset
+        self._cd_size = sum(46 + len(e['name']) for e in self._entries)
+        self.len = offset + self._cd_size + 22
+        if self.len > 0xffffffff or len(self._entries) > 0xffff:
+            raise ValueError("Archive too large, Zip64 is not supported")
+        self.bytes_read = 0
+        self._parts = self._iter_parts()
+        self._buffer = b''
+
+    def __len__(self):
+        return self.len
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def _iter_parts(self):
+        """ Yield the archive's bytes, in chunks """
+        for e in self._entries:
+            crc = 0
+            for chunk in self._read_file(e):
+                crc = zlib.crc32(chunk, crc)
+            e['crc'] = crc & 0xffffffff
+            yield struct.pack(
+                '<IHHHHHIIIHH', 0x04034b50, 20, e['flags'], 0,
+                e['dostime'][1], e['dostime'][0], e['crc'], e['size'],
+                e['size'], len(e['name']), 0) + e['name']
+            crc = 0
+            for chunk in self._read_file(e):
+                crc = zlib.crc32(chunk, crc)
+                yield chunk
+            if crc & 0xffffffff != e['crc']:
+                raise IOError("File changed while archived: " + e['path'])
+
+        for e in self._entries:
+            yield struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, e['flags'], 0,
+                e['dostime'][1], e['dostime'][0], e['crc'], e['size'],
+                e['size'], len(e['name']), 0, 0, 0, 0, 0,
+                e['offset']) + e['name']
+        yield struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(self._entries),
+                          len(self._entries), self._cd_size,
+                          self._cd_offset, 0)
+
+    def _read_file(self, entry):
+        """ Yield the content of an entry's file, in chunks """
+        remaining = entry['size']
+        with open(entry['path'], 'rb') as f:
+            while remaining:
+                chunk = f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    raise IOError(
+                        "File is shorter than expected: " + entry['path'])
+                remaining -= len(chunk)
+                yield chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.chunk_size
+        chunks = []
+        while size > 0:
+            if not self._buffer:
+                self._buffer = next(self._parts, b'')
+                if not self._buffer:
+                    break
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+            chunks.append(chunk)
+            size -= len(chunk)
+        data = b''.join(chunks)
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        """ Close the file being read, if any """
+        self._parts.close()
+
+
+def _dos_time(timestamp):
+    """ Return (date, time) of a timestamp in MS-DOS format """
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    return ((year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday,
+            t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2)
+
+
 class TemporaryDirectory(object):
     """
     Create and return a temporary directory.  This has the same behavior as
@@ -1,27 +1,661 @@
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool, cpu_count
+import json
+import logging
+import threading
+
 try:
     import fiona
     import fiona.transform
-except ImportError:
-    raise ImportError("Missing optional dependency: \"fiona\"")
+except ImportError:  # Required to read spatial files and `transform_layer`
+    fiona = None
+
+try:
+    import numpy
+    import pyproj
+except ImportError:  # Only required by `transform_layers`
+    numpy = pyproj = None
+
+try:
+    from shapely.geometry import box, mapping, shape
+    from shapely.strtree import STRtree
+except ImportError:  # Required by `SpatialIndex` and `Simplifier` tolerance
+    box = mapping = shape = STRtree = None
+
+logger = logging.getLogger(__name__)
+
+# Nesting depth of the coordinates of each geometry type
+_DEPTHS = {
+    'Point': 0, 'LineString': 1, 'MultiPoint': 1, 'Polygon': 2,
+    'MultiLineString': 2, 'MultiPolygon': 3,
+}
+_transformers = {}
+_transformers_lock = threading.Lock()
 
 
 def transform_layer(layer, epsg=4326):
     """
     Transform single layer to EPSG:4326 rounded to 6 decimal places.
     """
+    if fiona is None:
+        raise ImportError("Missing optional dependency: \"fiona\"")
     layer['geometry'] = fiona.transform.transform_geom(
         'EPSG:{}'.format(epsg), 'EPSG:4326', layer['geometry'], precision=6
     )
     return layer
 
 
-def prepare_geodata(path, default_epsg=None):
+def get_transformer(epsg):
     """
-    Given a path to an OGR-compatible spatial file, open file, convert to
-    EPSG:4326, round to 6 decimal places (11mm precision), and yield GeoJSON
-    Features from that file.
+    Return a (cached) transformer from EPSG:{epsg} to EPSG:4326, with
+    longitude/latitude axis order as used by GeoJSON.
+    """
+    epsg = str(epsg)
+    with _transformers_lock:
+        transformer = _transformers.get(epsg)
+        if transformer is None:
+            transformer = _transformers[epsg] = pyproj.Transformer.from_crs(
+                'EPSG:{}'.format(epsg), 'EPSG:4326', always_xy=True)
+    return transformer
+
+
+def transform_layers(layers, epsg=4326):
+    """
+    Transform many layers to EPSG:4326 rounded to 6 decimal places, with the
+    same output as calling `transform_layer` on each. Coordinates of all
+    layers are gathered into contiguous arrays and transformed in a single
+    call, avoiding the per-Feature cost of looking up the CRS and crossing
+    into PROJ. Requires numpy and pyproj.
     """
+    if pyproj is None:
+        raise ImportError("Missing optional dependency: \"numpy\", \"pyproj\"")
+    layers = list(layers)
+    points = []
+    for layer in layers:
+        _flatten(layer['geometry'], points)
+    if not points:
+        return layers
+
+    # Points may have a Z value, which is rounded but not transformed
+    xs = numpy.fromiter((p[0] for p in points), float, len(points))
+    ys = numpy.fromiter((p[1] for p in points), float, len(points))
+    xs, ys = get_transformer(epsg).transform(xs, ys)
+    # Round with Python's `round`, as `numpy.round` scales values and can
+    # differ from `transform_geom` in the last digit
+    transformed = iter([
+        (round(x, 6), round(y, 6)) + tuple(round(v, 6) for v in p[2:])
+        for x, y, p in zip(xs.tolist(), ys.tolist(), points)
+    ])
+    for layer in layers:
+        layer['geometry'] = _rebuild(layer['geometry'], transformed)
+    return layers
+
+
+def _flatten(geom, points):
+    """ Append every point of a GeoJSON geometry to points """
+    if geom is None:
+        return
+    if geom['type'] == 'GeometryCollection':
+        for g in geom['geometries']:
+            _flatten(g, points)
+        return
+    stack = [(geom['coordinates'], _DEPTHS[geom['type']])]
+    while stack:
+        coords, depth = stack.pop()
+        if depth == 0:
+            points.append(coords)
+        elif depth == 1:
+            points.extend(coords)
+        else:
+            stack.extend((c, depth - 1) for c in reversed(coords))
+
+
+def _rebuild(geom, points):
+    """
+    Return copy of a GeoJSON geometry with its points replaced, in order, by
+    the items of the points iterator
+    """
+    if geom is None:
+        return None
+    if geom['type'] == 'GeometryCollection':
+        geoms = [_rebuild(g, points) for g in geom['geometries']]
+        return {'type': geom['type'], 'geometries': geoms}
+
+    def build(coords, depth):
+        if depth == 0:
+            return next(points)
+        if depth == 1:
+            return [next(points) for _ in coords]
+        return [build(c, depth - 1) for c in coords]
+
+    return {'type': geom['type'],
+            'coordinates': build(geom['coordinates'], _DEPTHS[geom['type']])}
+
+
+def _transform_chunk(args):
+    """ Transform a chunk of layers sharing an EPSG code (in a worker) """
+    layers, epsg, vectorize = args
+    if vectorize:
+        return transform_layers(layers, epsg=epsg)
+    return [transform_layer(layer, epsg=epsg) for layer in layers]
+
+
+def read_geodata(path, default_epsg=None):
+    """
+    Given a path to an OGR-compatible spatial file, open file and yield its
+    GeoJSON Features (untransformed) along with the EPSG code of their CRS.
+    """
+    if fiona is None:
+        raise ImportError("Missing optional dependency: \"fiona\"")
     with fiona.open(path) as data:
         epsg = data.crs.get('init', str(default_epsg)).split(':')[-1]
         for layer in data:
-            yield transform_layer(layer, epsg=epsg)
+            yield layer, epsg
+
+
+def _read_chunks(path, default_epsg, chunk_size, vectorize):
+    features = read_geodata(path, default_epsg)
+    while True:
+        chunk = list(islice(features, chunk_size))
+        if not chunk:
+            return
+        yield [layer for layer, _ in chunk], chunk[0][1], vectorize
+
+
+def prepare_geodata(path, default_epsg=None, processes=1, chunk_size=256,
+                    pool=None, vectorize=False):
+    """
+    Given a path to an OGR-compatible spatial file, open file, convert to
+    EPSG:4326, round to 6 decimal places (11mm precision), and yield GeoJSON
+    Features from that file.
+
+    Reprojection is CPU-bound and holds the GIL, so with `processes` greater
+    than 1 (or a `pool`) chunks of Features are reprojected by a pool of
+    processes. Features are still yielded in the order of the file, and at
+    most two chunks per process are read ahead of the consumer.
+
+    Args:
+        path (str): Path to spatial file.
+        default_epsg (int, optional): EPSG code used when the file does not
+            specify its CRS.
+        processes (int, optional): Number of processes reprojecting
+            Features, or the size of `pool` if provided. None uses the number
+            of CPUs. Defaults to 1 (reproject on the calling thread).
+        chunk_size (int, optional): Number of Features sent to a process at
+            once. Defaults to 256.
+        pool (multiprocessing.Pool, optional): Existing pool to use instead
+            of starting one, e.g. to share it between files. It is left
+            running.
+        vectorize (bool, optional): Transform each chunk of Features with a
+            single call to `transform_layers`. Requires numpy and pyproj.
+            Defaults to False.
+    """
+    if vectorize and pyproj is None:
+        raise ImportError("Missing optional dependency: \"numpy\", \"pyproj\"")
+    chunks = _read_chunks(path, default_epsg, chunk_size, vectorize)
+    if pool is None and processes == 1:
+        if vectorize:
+            for chunk in chunks:
+                for layer in _transform_chunk(chunk):
+                    yield layer
+        else:
+            for layer, epsg in read_geodata(path, default_epsg):
+                yield transform_layer(layer, epsg=epsg)
+        return
+
+    own_pool = pool is None
+    if own_pool:
+        pool = Pool(processes)
+    window = 2 * (processes or cpu_count())
+    pending = deque()
+    try:
+        while True:
+            for chunk in chunks:
+                pending.append(pool.apply_async(_transform_chunk, (chunk,)))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+            for layer in pending.popleft().get():
+                yield layer
+    finally:
+        if own_pool:
+            pool.terminate()
+            pool.join()
+
+
+def dumps(layer):
+    """ Serialize GeoJSON compactly, without whitespace between tokens """
+    return json.dumps(layer, separators=(',', ':'))
+
+
+def _clean_path(coords, closed, epsilon):
+    """
+    Remove repeated vertices and vertices lying (within epsilon) on the
+    straight segment between their neighbours from a LineString or ring.
+    The ends of a LineString are kept, and rings are treated as cyclic.
+    """
+    points = []
+    for p in (coords[:-1] if closed else coords):
+        if not points or tuple(p) != tuple(points[-1]):
+            points.append(p)
+    if closed and len(points) > 1 and tuple(points[0]) == tuple(points[-1]):
+        points.pop()
+
+    # Repeatedly drop collinear vertices, as dropping one can make its
+    # neighbours collinear
+    minimum = 3 if closed else 2
+    changed = True
+    while changed and len(points) > minimum:
+        changed = False
+        kept = []
+        n = len(points)
+        for i, p in enumerate(points):
+            if closed:
+                a = kept[-1] if kept else points[i - 1]
+                b = points[i + 1] if i + 1 < n else kept[0]
+            elif 0 < i < n - 1:
+                a, b = kept[-1], points[i + 1]
+            else:
+                kept.append(p)
+                continue
+            if (n - (i - len(kept)) > minimum and
+                    _is_between(a, p, b, epsilon)):
+                changed = True
+            else:
+                kept.append(p)
+        points = kept
+
+    if len(points) < minimum:  # Degenerate, leave as is
+        return coords
+    if closed:
+        points.append(points[0])
+    return points
+
+
+def _is_between(a, p, b, epsilon):
+    """ Whether p lies within epsilon of the segment from a to b """
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length_sq = dx * dx + dy * dy
+    if not length_sq:
+        return False
+    cross = dx * (p[1] - a[1]) - dy * (p[0] - a[0])
+    if cross * cross > epsilon * epsilon * length_sq:
+        return False
+    dot = dx * (p[0] - a[0]) + dy * (p[1] - a[1])
+    return 0 <= dot <= length_sq
+
+
+def clean_geometry(geom, epsilon=1e-7):
+    """
+    Return copy of a GeoJSON geometry without repeated or collinear vertices
+    (see `_clean_path`). Points are returned unchanged.
+
+    Args:
+        geom (dict): GeoJSON geometry.
+        epsilon (float, optional): Maximum distance, in units of the
+            coordinates, of a vertex from the segment joining its neighbours
+            for it to be considered collinear. Defaults to 1e-7, below the
+            6 decimal places kept by `transform_layer`.
+    """
+    if geom is None:
+        return None
+    kind = geom['type']
+    if kind == 'GeometryCollection':
+        geoms = [clean_geometry(g, epsilon) for g in geom['geometries']]
+        return {'type': kind, 'geometries': geoms}
+    coords = geom['coordinates']
+    if kind == 'LineString':
+        coords = _clean_path(coords, False, epsilon)
+    elif kind == 'MultiLineString':
+        coords = [_clean_path(c, False, epsilon) for c in coords]
+    elif kind == 'Polygon':
+        coords = [_clean_path(c, True, epsilon) for c in coords]
+    elif kind == 'MultiPolygon':
+        coords = [[_clean_path(c, True, epsilon) for c in poly]
+                  for poly in coords]
+    return {'type': kind, 'coordinates': coords}
+
+
+def count_vertices(geom):
+    points = []
+    _flatten(geom, points)
+    return len(points)
+
+
+class Simplifier(object):
+
+    def __init__(self, tolerance=0, epsilon=1e-7):
+        """
+        Shrink the GeoJSON of layers before upload, recording how much it
+        shrank. Removes repeated and collinear vertices and, if a tolerance
+        is provided, simplifies geometries without changing their topology
+        (requires shapely). Safe to share between threads:
+
+            simplifier = geo.Simplifier(tolerance=1e-6)
+            for layer in geo.prepare_geodata(path):
+                cnxn.post(url, data=simplifier.dumps(simplifier(layer)),
+                          headers={'Content-Type': 'application/json'})
+            logger.info(simplifier.summary())
+
+        Args:
+            tolerance (float, optional): Maximum distance, in units of the
+                coordinates (degrees for EPSG:4326), between simplified and
+                original geometries. Defaults to 0 (no simplification).
+            epsilon (float, optional): See `clean_geometry`.
+        """
+        if tolerance and shape is None:
+            raise ImportError("Missing optional dependency: \"shapely\"")
+        self.tolerance = tolerance
+        self.epsilon = epsilon
+        self.layers = 0
+        self.vertices_in = self.vertices_out = 0
+        self.bytes_in = self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<{} tolerance={!r}>'.format(
+            self.__class__.__name__, self.tolerance)
+
+    def __call__(self, layer):
+        """ Shrink geometry of layer (in place), returning the layer """
+        geom = layer['geometry']
+        vertices_in = count_vertices(geom)
+        bytes_in = len(json.dumps(layer))
+
+        geom = clean_geometry(geom, self.epsilon)
+        if self.tolerance and geom is not None:
+            simplified = shape(geom).simplify(self.tolerance,
+                                              preserve_topology=True)
+            if not simplified.is_empty:
+                geom = _round_coords(mapping(simplified))
+        layer['geometry'] = geom
+
+        vertices_out = count_vertices(geom)
+        bytes_out = len(dumps(layer))
+        with self._lock:
+            self.layers += 1
+            self.vertices_in += vertices_in
+            self.vertices_out += vertices_out
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+        return layer
+
+    dumps = staticmethod(dumps)
+
+    def summary(self):
+        """ Return a human-readable summary of the shrinkage """
+        def ratio(out, total):
+            return 100. * (total - out) / total if total else 0.
+
+        with self._lock:
+            return (
+                'Simplified {} layers: {} -> {} vertices (-{:.1f}%), '
+                '{} -> {} bytes (-{:.1f}%)'.format(
+                    self.layers, self.vertices_in, self.vertices_out,
+                    ratio(self.vertices_out, self.vertices_in),
+                    self.bytes_in, self.bytes_out,
+                    ratio(self.bytes_out, self.bytes_in)))
+
+
+def _round_coords(geom, precision=6):
+    """ Round coordinates of a GeoJSON geometry, as output by shapely """
+    def build(coords, depth):
+        if depth == 0:
+            return tuple(round(v, precision) for v in coords)
+        return [build(c, depth - 1) for c in coords]
+
+    if geom['type'] == 'GeometryCollection':
+        return {'type': geom['type'], 'geometries': [
+            _round_coords(g, precision) for g in geom['geometries']]}
+    return {'type': geom['type'],
+            'coordinates': build(geom['coordinates'], _DEPTHS[geom['type']])}
+
+
+def _canonical_ring(ring):
+    """ Ring as a tuple independent of its start vertex and orientation """
+    points = [tuple(p) for p in ring[:-1]]
+    if not points:
+        return ()
+    candidates = []
+    for seq in (points, points[::-1]):
+        i = seq.index(min(seq))
+        candidates.append(tuple(seq[i:] + seq[:i]))
+    return min(candidates)
+
+
+def canonical_key(geom):
+    """
+    Return hashable key of a GeoJSON geometry, equal for geometries with the
+    same vertices regardless of the start vertex and orientation of rings
+    or the order of parts.
+    """
+    kind = geom['type']
+    if kind == 'GeometryCollection':
+        return (kind, tuple(sorted(
+            canonical_key(g) for g in geom['geometries'])))
+    coords = geom['coordinates']
+    if kind == 'Point':
+        key = tuple(coords)
+    elif kind in ('LineString', 'MultiPoint'):
+        points = tuple(tuple(p) for p in coords)
+        key = min(points, points[::-1]) if kind == 'LineString' else points
+        if kind == 'MultiPoint':
+            key = tuple(sorted(key))
+    elif kind == 'MultiLineString':
+        key = tuple(sorted(canonical_key({'type': 'LineString',
+                                          'coordinates': c})
+                           for c in coords))
+    elif kind == 'Polygon':
+        key = (_canonical_ring(coords[0]),
+               tuple(sorted(_canonical_ring(r) for r in coords[1:])))
+    else:  # MultiPolygon
+        key = tuple(sorted(canonical_key({'type': 'Polygon',
+                                          'coordinates': c})
+                           for c in coords))
+    return (kind, key)
+
+
+class SpatialIndex(object):
+
+    # Number of geometries checked linearly before being bulk-loaded into a
+    # tree
+    buffer_size = 64
+
+    def __init__(self, near_tolerance=1e-6, overlap_threshold=0.9):
+        """
+        In-memory index of geometries (each with a value, e.g. the ID of its
+        Location), used to find duplicates of new geometries before they are
+        uploaded. Geometries are matched as:
+
+            'exact'    Same vertices, in any ring order or orientation.
+            'near'     Hausdorff distance of at most `near_tolerance`.
+            'overlap'  Intersection over union of at least
+                       `overlap_threshold`, so that a parcel lying within a
+                       larger one isn't a duplicate of it.
+
+        Geometries can be added as they stream in. Shapely's STR-trees can't
+        be modified once built, so the index is kept as trees of
+        exponentially growing sizes, merged like the digits of a binary
+        counter (the Bentley-Saxe method): insertions take amortized
+        O(log n) and queries O(log^2 n). Requires shapely. Safe to share
+        between threads:
+
+            index = geo.SpatialIndex()
+            for layer in geo.prepare_geodata(path):
+                match = index.match(layer['geometry'])
+                if match:
+                    kind, su_id = match
+                    ...
+                else:
+                    su = cnxn.post(url, json=layer).json()
+                    index.insert(layer['geometry'], su['properties']['id'])
+
+        Args:
+            near_tolerance (float, optional): Maximum distance, in units of
+                the coordinates, between near-duplicate geometries. Defaults
+                to 1e-6 (about 11cm in EPSG:4326). None disables
+                near-duplicate detection.
+            overlap_threshold (float, optional): Minimum ratio of the area
+                of the intersection of two geometries to the area of their
+                union for them to be considered overlapping. Defaults to
+                0.9. None disables overlap detection.
+        """
+        if STRtree is None:
+            raise ImportError("Missing optional dependency: \"shapely\"")
+        self.near_tolerance = near_tolerance
+        self.overlap_threshold = overlap_threshold
+        self._exact = {}
+        self._buffer = []
+        self._levels = []  # _Level instances, or None
+        self._removed = set()  # id() of values discarded from the levels
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<{} size={}>'.format(self.__class__.__name__, len(self))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._exact)
+
+    def match(self, geom):
+        """
+        Return (kind, value) of the first indexed geometry matching a
+        GeoJSON geometry, or None. Exact matches are preferred over near
+        duplicates, themselves preferred over overlaps.
+        """
+        key = canonical_key(geom)
+        with self._lock:
+            return self._match(key, shape(geom))
+
+    def insert(self, geom, value):
+        """ Add a GeoJSON geometry and its value to the index """
+        key = canonical_key(geom)
+        with self._lock:
+            self._insert(key, shape(geom), value)
+
+    def match_or_insert(self, geom, value):
+        """
+        Return match of a GeoJSON geometry (see `match`) or, if it has none,
+        atomically insert it and return None. Useful when uploading from
+        many threads, with a `Future` of the created Location as value.
+        """
+        key = canonical_key(geom)
+        geometry = shape(geom)
+        with self._lock:
+            match = self._match(key, geometry)
+            if match is None:
+                self._insert(key, geometry, value)
+            return match
+
+    def discard(self, geom, value):
+        """
+        Remove a GeoJSON geometry inserted with a value (compared by
+        identity), if indexed. E.g. when creating the Location whose
+        `Future` was inserted by `match_or_insert` failed, so that the next
+        duplicate creates it instead.
+        """
+        key = canonical_key(geom)
+        with self._lock:
+            if self._exact.get(key) is value:
+                del self._exact[key]
+            buffered = [item for item in self._buffer if item[1] is not value]
+            if len(buffered) < len(self._buffer):
+                self._buffer = buffered
+            elif any(level is not None and level.contains(value)
+                     for level in self._levels):
+                # Trees can't be modified: skip the value until its level
+                # is rebuilt
+                self._removed.add(id(value))
+
+    def insert_features(self, features):
+        """
+        Add GeoJSON Features, using the ID in their properties as value, e.g.
+        the existing Locations of a project:
+
+            index.insert_features(cnxn.get(endpoints.locations(org, proj),
+                                           follow_pagination=True))
+        """
+        for feature in features:
+            if feature.get('geometry'):
+                self.insert(feature['geometry'], feature['properties']['id'])
+
+    def _match(self, key, geometry):
+        if key in self._exact:
+            return ('exact', self._exact[key])
+        if self.near_tolerance is None and self.overlap_threshold is None:
+            return None
+
+        tol = self.near_tolerance or 0
+        minx, miny, maxx, maxy = geometry.bounds
+        envelope = box(minx - tol, miny - tol, maxx + tol, maxy + tol)
+        candidates = list(self._buffer)
+        for level in self._levels:
+            if level is not None:
+                candidates.extend(level.query(envelope))
+        if self._removed:
+            candidates = [(g, v) for g, v in candidates
+                          if id(v) not in self._removed]
+
+        best = None
+        for other, value in candidates:
+            if (self.near_tolerance is not None and
+                    geometry.hausdorff_distance(other) <= tol):
+                return ('near', value)
+            if best is None and self._overlaps(geometry, other):
+                best = ('overlap', value)
+        return best
+
+    def _overlaps(self, a, b):
+        if self.overlap_threshold is None:
+            return False
+        if not (a.area and b.area) or not a.intersects(b):
+            return False
+        intersection = a.intersection(b).area
+        union = a.area + b.area - intersection
+        return intersection / union >= self.overlap_threshold
+
+    def _insert(self, key, geometry, value):
+        self._exact.setdefault(key, value)
+        self._buffer.append((geometry, value))
+        if len(self._buffer) < self.buffer_size:
+            return
+
+        # Carry the full buffer into the levels: merge it with every
+        # occupied level below the first empty one, and build one tree
+        items, self._buffer = self._buffer, []
+        for i, level in enumerate(self._levels):
+            if level is None:
+                break
+            items.extend(level.items)
+            self._levels[i] = None
+        if self._removed:
+            dropped = self._removed.intersection(id(v) for _, v in items)
+            items = [(g, v) for g, v in items if id(v) not in dropped]
+            self._removed -= dropped
+        else:
+            i = len(self._levels)
+            self._levels.append(None)
+        self._levels[i] = _Level(items) if items else None
+
+
+class _Level(object):
+    """ STR-tree of (geometry, value) items """
+
+    def __init__(self, items):
+        self.items = items
+        self.tree = STRtree([g for g, _ in items])
+        # Shapely < 2 returns geometries rather than indices from queries
+        self._by_id = dict((id(g), (g, v)) for g, v in items)
+        self._values = set(id(v) for _, v in items)
+
+    def contains(self, value):
+        return id(value) in self._values
+
+    def query(self, envelope):
+        """ Return items whose geometry's bounds intersect envelope """
+        result = self.tree.query(envelope)
+        if len(result) and hasattr(result[0], 'geom_type'):
+            return [self._by_id[id(g)] for g in result]
+        return [self.items[i] for i in result]
@@ -1,4 +1,8 @@
 import mimetypes
+import os
+import uuid
+
+import six
 
 
 def get_mime_type(path):
@@ -6,3 +10,139 @@ def get_mime_type(path):
     Attempt to determine file's mimetype based on its path or URL.
     """
     return mimetypes.guess_type(path)[0]
+
+
+class MultipartEncoder(object):
+    """
+    File-like object streaming a multipart/form-data body made of form fields
+    followed by a single file. The file is read in chunks as the body is
+    consumed, so memory use doesn't depend on the size of the file. Can be
+    passed as `data` to `requests`, which will send it with a known
+    Content-Length:
+
+        with open(path, 'rb') as f:
+            body = MultipartEncoder(fields, 'file', f, 'photo.jpg')
+            requests.post(url, data=body,
+                          headers={'Content-Type': body.content_type})
+    """
+
+    def __init__(self, fields, file_field, fileobj, filename, size=None,
+                 content_type=None, chunk_size=64 * 1024, callback=None):
+        """
+        Args:
+            fields (dict): Form fields preceding the file.
+            file_field (str): Name of the form field holding the file.
+            fileobj (file-like): Object to read file content from.
+            filename (str): Filename reported for the file.
+            size (int, optional): Size of the file content. Defaults to the
+                size of the file behind `fileobj`.
+            content_type (str, optional): Content type of the file part.
+                Defaults to None (no content type).
+            chunk_size (int, optional): Number of bytes read at once when
+                no size is given to `read()`, and when iterating. Defaults to
+                64 KiB.
+            callback (callable, optional): Called with the number of bytes
+                read so far and the total number of bytes after each read.
+        """
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(
+            self.boundary)
+        self.chunk_size = chunk_size
+        self.callback = callback
+
+        if size is None:
+            size = os.fstat(fileobj.fileno()).st_size
+        self._fileobj = fileobj
+        self._file_remaining = size
+
+        head = []
+        for name, value in fields.items():
+            head.append(self._part_header(name))
+            head.append(_to_bytes(value) + b'\r\n')
+        head.append(self._part_header(file_field, filename, content_type))
+        self._head = b''.join(head)
+        self._tail = '\r\n--{}--\r\n'.format(self.boundary).encode('ascii')
+        self._buffer = self._head
+
+        self.len = len(self._head) + size + len(self._tail)
+        self.bytes_read = 0
+
+    def __len__(self):
+        return self.len
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def _part_header(self, name, filename=None, content_type=None):
+        disposition = 'form-data; name="{}"'.format(_quote(name))
+        if filename is not None:
+            disposition += '; filename="{}"'.format(_quote(filename))
+        lines = ['--' + self.boundary,
+                 'Content-Disposition: ' + disposition]
+        if content_type:
+            lines.append('Content-Type: ' + content_type)
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.chunk_size
+        chunks = []
+        while size > 0:
+            if not self._buffer and not self._file_remaining:
+                self._buffer, self._tail = self._tail, b''
+            if self._buffer:
+                chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+            elif self._file_remaining:
+                chunk = self._fileobj.read(min(size, self._file_remaining))
+                if not chunk:
+                    raise IOError("File is shorter than expected")
+                self._file_remaining -= len(chunk)
+            else:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        data = b''.join(chunks)
+        self.bytes_read += len(data)
+        if self.callback and data:
+            self.callback(self.bytes_read, self.len)
+        return data
+
+
+class IterReader(object):
+    """
+    File-like object reading from an iterable of bytes chunks (e.g. a
+    generator), so that it can be streamed with `MultipartEncoder`.
+    """
+
+    def __init__(self, iterable):
+        self._chunks = iter(iterable)
+        self._buffer = b''
+
+    def read(self, size=-1):
+        chunks = []
+        while size is None or size < 0 or size > 0:
+            if not self._buffer:
+                self._buffer = next(self._chunks, b'')
+                if not self._buffer:
+                    break
+            if size is None or size < 0:
+                chunk, self._buffer = self._buffer, b''
+            else:
+                chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+                size -= len(chunk)
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+
+def _quote(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _to_bytes(value):
+    if isinstance(value, six.binary_type):
+        return value
+    return six.text_type(value).encode('utf-8')
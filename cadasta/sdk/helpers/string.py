@@ -1,4 +1,7 @@
+from collections import Counter
 from difflib import SequenceMatcher
+from itertools import chain
+import heapq
 
 
 def slugify(string, max_length=50):
@@ -17,3 +20,135 @@ def similarity(str1, str2):
     working with datasets that contain many typos.
     """
     return SequenceMatcher(None, str1, str2).ratio()
+
+
+def _normalize(string):
+    return ' '.join(string.lower().split())
+
+
+class FuzzyIndex(object):
+
+    def __init__(self, names=(), n=3, normalize=_normalize):
+        """
+        Index of names for fast typo-tolerant lookups. Rather than scoring a
+        query against every name with `similarity`, candidates sharing at
+        least one n-gram with the query are gathered from an inverted index,
+        those that can't reach the threshold (by length or by
+        `SequenceMatcher`'s cheap upper bounds) are skipped, and only the
+        rest are scored:
+
+            index = FuzzyIndex()
+            for party in cnxn.get(url, follow_pagination=True):
+                index.add(party['name'], party['id'])
+            matches = index.search('Jon Smiht', k=3, min_similarity=0.8)
+            # [(0.89, 'John Smith', 'abc123'), ...]
+
+        Args:
+            names (iterable, optional): Names to index, each with itself as
+                value.
+            n (int, optional): Length of the n-grams. Defaults to 3.
+            normalize (callable, optional): Applied to names and queries
+                before comparing them. Defaults to lowercasing and collapsing
+                whitespace.
+        """
+        self.n = n
+        self.normalize = normalize
+        self._entries = []  # (normalized name, name, value)
+        self._postings = {}  # n-gram -> [entry index, ...]
+        for name in names:
+            self.add(name)
+
+    def __repr__(self):
+        return '<{} size={}>'.format(self.__class__.__name__, len(self))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _ngrams(self, string):
+        padded = ' ' * (self.n - 1) + string + ' ' * (self.n - 1)
+        # Empty strings (which have no unigrams) still share an n-gram
+        return set(padded[i:i + self.n]
+                   for i in range(len(padded) - self.n + 1)) or set([''])
+
+    def add(self, name, value=None):
+        """ Index name, with an associated value (defaults to the name) """
+        normalized = self.normalize(name)
+        i = len(self._entries)
+        self._entries.append(
+            (normalized, name, name if value is None else value))
+        for gram in self._ngrams(normalized):
+            self._postings.setdefault(gram, []).append(i)
+
+    def update(self, items):
+        """ Index (name, value) pairs """
+        for name, value in items:
+            self.add(name, value)
+
+    def search(self, query, k=5, min_similarity=0.6, exhaustive=False):
+        """
+        Return up to k (similarity, name, value) tuples of the indexed names
+        most similar to query, best first, with a similarity (as computed by
+        `similarity(name, query)`) of at least `min_similarity`.
+
+        Only names sharing an n-gram with the query are scored. Other names
+        are only matched by blocks shorter than n characters, so their
+        similarity is below 2(n - 1) / (2n - 1) (0.8 for trigrams): above
+        that threshold, results are those of scoring every name. Below it,
+        names sharing no n-gram are missed unless `exhaustive` is set, which
+        falls back to a (slow) linear scan of the remaining names.
+        """
+        query = self.normalize(query)
+        shared = Counter(chain.from_iterable(
+            self._postings.get(gram, ()) for gram in self._ngrams(query)))
+
+        # Score the most promising candidates first, so that the threshold
+        # rises quickly and prunes the rest
+        best = []  # Min-heap of (similarity, -index)
+        # SequenceMatcher caches information about its second sequence
+        matcher = SequenceMatcher(None, '', query)
+        self._score(matcher, (i for i, _ in shared.most_common()), best, k,
+                    min_similarity)
+
+        threshold = best[0][0] if len(best) >= k else min_similarity
+        if exhaustive and threshold < 2. * (self.n - 1) / (2 * self.n - 1):
+            self._score(matcher, (i for i in range(len(self._entries))
+                                  if i not in shared), best, k,
+                        min_similarity)
+
+        return [(score, self._entries[-i][1], self._entries[-i][2])
+                for score, i in sorted(best, reverse=True)]
+
+    def _score(self, matcher, indices, best, k, min_similarity):
+        """ Push entries scoring among the k best onto the `best` heap """
+        size = len(matcher.b)
+        for i in indices:
+            threshold = best[0][0] if len(best) >= k else min_similarity
+            normalized = self._entries[i][0]
+            total = size + len(normalized)
+            # Two empty strings are identical
+            if total and 2. * min(size, len(normalized)) / total < threshold:
+                continue
+            matcher.set_seq1(normalized)
+            if (matcher.real_quick_ratio() < threshold or
+                    matcher.quick_ratio() < threshold):
+                continue
+            item = (matcher.ratio(), -i)  # Ties favour earlier names
+            if len(best) < k:
+                if item[0] >= min_similarity:
+                    heapq.heappush(best, item)
+            elif item > best[0]:
+                heapq.heapreplace(best, item)
+
+    def search_many(self, queries, k=5, min_similarity=0.6,
+                    exhaustive=False):
+        """
+        Yield results of `search` for each query, in order. Repeated queries
+        are only searched once.
+        """
+        cache = {}
+        for query in queries:
+            key = self.normalize(query)
+            if key not in cache:
+                cache[key] = self.search(query, k, min_similarity,
+                                         exhaustive)
+            yield cache[key]
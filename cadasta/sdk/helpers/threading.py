@@ -1,31 +1,283 @@
 from __future__ import absolute_import
 
+from concurrent.futures import Future
 from multiprocessing import cpu_count
+import itertools
 import threading
 import logging
+import time
 
 from six import moves
+from six.moves import reprlib
 
 
 logger = logging.getLogger(__name__)
 
 
 class Queue(moves.queue.Queue, object):
+    def __init__(self, maxsize=0, put_timeout=None, journal=None):
+        """
+        Args:
+            maxsize (int, optional): Maximum number of pending tasks. Defaults
+                to 0 (unbounded).
+            put_timeout (float, optional): Number of seconds `put` may block
+                on a full queue before raising `Full`. Defaults to None
+                (block until a slot is free).
+            journal (Journal, optional): Journal used to skip tasks completed
+                in a previous run and to record completed tasks. Defaults to
+                None.
+        """
+        super(Queue, self).__init__(maxsize)
+        self.put_timeout = put_timeout
+        self.journal = journal
+        # Object passed to tasks as their first argument
+        self.context = self
+        self._local = threading.local()
+
     def put(self, func, *args, **kwargs):
-        return super(Queue, self).put((func, args, kwargs))
+        """
+        Schedule `func` to be called with the queue and the provided args and
+        kwargs. Blocks while the queue is full. Tasks scheduled from a worker
+        thread of the queue are instead run inline when the queue is full, as
+        workers blocking on their own queue could deadlock the pool.
+        """
+        node = None
+        if self.journal is not None:
+            node = _JournalNode(
+                self.journal, getattr(self._local, 'node', None),
+                *self.journal.task_key(func, args, kwargs))
+        item = (func, args, kwargs, node)
+        if getattr(self._local, 'is_worker', False):
+            try:
+                return super(Queue, self).put(item, block=False)
+            except moves.queue.Full:
+                logger.debug("Queue full, running %s inline", func.__name__)
+                return self.process(*item)
+        return super(Queue, self).put(item, timeout=self.put_timeout)
+
+    def process(self, func, args, kwargs, node=None):
+        """
+        Run task, logging rather than raising any exception.
+        """
+        signature = _Signature(func, args, kwargs)
+        if node is None:
+            logger.debug("Processing %s", signature)
+            try:
+                func(self.context, *args, **kwargs)
+            except Exception:
+                logger.exception("Failed to process %s", signature)
+            return
+
+        if self.journal.is_complete(node.key):
+            logger.debug("Skipping %s, completed in previous run", signature)
+            return node.done(record=False)
+        logger.debug("Processing %s", signature)
+        parent_node, self._local.node = getattr(self._local, 'node', None), node
+        try:
+            node.result = func(self.context, *args, **kwargs)
+        except Exception:
+            node.failed = True
+            logger.exception("Failed to process %s", signature)
+        finally:
+            self._local.node = parent_node
+            node.done()
+
+
+class _JournalNode(object):
+    """
+    Journal entry of a queued task. A task is recorded as complete once it
+    and every task it scheduled (recursively) have succeeded, so that a
+    task skipped on restart never hides unfinished follow-up work.
+    """
+
+    def __init__(self, journal, parent, key, source, content_hash):
+        self.journal = journal
+        self.key = key
+        self.source = source
+        self.content_hash = content_hash
+        self.parent = parent
+        self.result = None
+        self.failed = False
+        self._pending = 1  # The task itself
+        self._lock = threading.Lock()
+        if parent is not None:
+            with parent._lock:
+                parent._pending += 1
+
+    def done(self, record=True):
+        with self._lock:
+            self._pending -= 1
+            if self._pending:
+                return
+        if record and not self.failed:
+            self.journal.record(self.key, self.result, self.source,
+                                self.content_hash)
+        if self.parent is not None:
+            if self.failed:
+                self.parent.failed = True
+            self.parent.done()
+
+
+class _Signature(object):
+    """
+    Lazily formatted call signature for log messages, so that the (possibly
+    large) arguments are only formatted if the message is emitted, and with
+    their reprs truncated.
+    """
+    repr = reprlib.Repr()
+    repr.maxstring = repr.maxother = 80
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return "{}({})".format(
+            self.func.__name__,
+            ', '.join([x for x in [
+                ', '.join([self.repr.repr(arg) for arg in self.args]),
+                ', '.join('{}={}'.format(k, self.repr.repr(v))
+                          for k, v in self.kwargs.items())
+            ] if x]))
+
+
+class AdaptiveConcurrency(object):
+    def __init__(self, min_workers=1, max_workers=32, initial=None,
+                 latency_threshold=None, decrease_factor=0.5, cooldown=1.0):
+        """
+        AIMD (additive-increase, multiplicative-decrease) limit on the number
+        of tasks running at once, driven by the outcome of the requests they
+        make. Attach it to a session to observe its requests and pass it to
+        a `ThreadQueue`:
+
+            concurrency = AdaptiveConcurrency(max_workers=32)
+            concurrency.attach(cnxn)
+            with ThreadQueue(concurrency=concurrency) as q:
+                ...
+
+        After roughly `limit` consecutive successful requests the limit
+        grows by one. A connection error, a 429 or 5xx response or (if
+        configured) a slow response multiplies it by `decrease_factor`.
+
+        Args:
+            min_workers (int, optional): Lower bound of the limit. Defaults
+            to 1.
+            max_workers (int, optional): Upper bound of the limit. Defaults
+            to 32.
+            initial (int, optional): Starting limit. Defaults to
+            `min_workers`.
+            latency_threshold (float, optional): Seconds after which a
+            response counts as a sign of an overloaded server. Defaults to
+            None (latency is ignored).
+            decrease_factor (float, optional): Factor applied to the limit on
+            congestion. Defaults to 0.5.
+            cooldown (float, optional): Minimum number of seconds between two
+            decreases, so that a burst of failures from requests sent at the
+            previous limit only counts once. Defaults to 1.
+        """
+        assert 1 <= min_workers <= max_workers, (
+            "Expected 1 <= min_workers <= max_workers")
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.limit = initial or min_workers
+        self.latency_threshold = latency_threshold
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self.active = 0
+        self._successes = 0
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+
+    def __repr__(self):
+        return '<{} limit={} active={}>'.format(
+            self.__class__.__name__, self.limit, self.active)
+
+    def attach(self, session):
+        """ Observe the requests of a `CadastaSession` """
+        session.add_observer(self)
+        return self
+
+    def acquire(self):
+        """ Block until a task may start """
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def wake(self):
+        """ Wake all threads waiting in `acquire` to check the limit """
+        with self._cond:
+            self._cond.notify_all()
+
+    def __call__(self, response=None, error=None, elapsed=0, **kwargs):
+        congested = (
+            error is not None or
+            (response is not None and (response.status_code == 429 or
+                                       response.status_code >= 500)) or
+            (self.latency_threshold is not None and
+             elapsed > self.latency_threshold)
+        )
+        with self._cond:
+            if congested:
+                now = time.time()
+                if now - self._last_decrease < self.cooldown:
+                    return
+                self._last_decrease = now
+                self._successes = 0
+                limit = max(self.min_workers,
+                            int(self.limit * self.decrease_factor))
+                if limit != self.limit:
+                    logger.info("Decreasing concurrency to %d", limit)
+                self.limit = limit
+            else:
+                self._successes += 1
+                if (self._successes >= self.limit and
+                        self.limit < self.max_workers):
+                    self._successes = 0
+                    self.limit += 1
+                    logger.debug("Increasing concurrency to %d", self.limit)
+                    self._cond.notify()
 
 
 class ThreadQueue(object):
-    def __init__(self, cpu_multiplier=2):
+    def __init__(self, cpu_multiplier=2, maxsize=0, put_timeout=None,
+                 concurrency=None, journal=None):
         """
         Args:
             cpu_multiplier (int, optional): Number of threads per cpu. Set
             to 0 for single-threaded operation. Thread-count maxes out at 8
             threads (to avoid overloading the Cadasta webserver).
+            maxsize (int, optional): Maximum number of pending tasks. Once
+            reached, producers block until workers catch up, keeping memory
+            use flat regardless of dataset size. Defaults to 0 (unbounded).
+            put_timeout (float, optional): Number of seconds a producer may
+            block on a full queue before `Full` is raised. Defaults to None
+            (block indefinitely).
+            concurrency (AdaptiveConcurrency, optional): Adaptive limit on
+            the number of tasks processed at once. When provided, one thread
+            is started per `concurrency.max_workers` (ignoring
+            `cpu_multiplier` and the 8 thread cap) and the controller decides
+            how many of them may run. Defaults to None.
+            journal (Journal, optional): Journal of completed tasks. Tasks
+            completed in a previous run with the same journal are skipped.
+            A task counts as completed once it and all tasks it scheduled
+            have run without raising; its return value is recorded as its
+            result. Defaults to None.
         """
 
-        self.q = Queue()
-        self.num_threads = min([(cpu_count() * cpu_multiplier) or 1, 8])
+        self.q = Queue(maxsize, put_timeout, journal)
+        self.concurrency = concurrency
+        if concurrency is not None:
+            self.num_threads = concurrency.max_workers
+        else:
+            self.num_threads = min([(cpu_count() * cpu_multiplier) or 1, 8])
         self.killswitch = threading.Event()
 
     def __enter__(self):
@@ -40,33 +292,176 @@ class ThreadQueue(object):
     def __exit__(self, exc_type, exc_value, traceback):
         self.q.join()
         self.killswitch.set()
+        if self.concurrency is not None:
+            self.concurrency.wake()
         logger.debug("Exiting ThreadQueue context")
 
     def worker(self, name):
         """
-        Thread worker. Expects queue to be populated with three-ples of a
-        function to run and related input args and kwargs.
+        Thread worker. Expects queue to be populated (via `Queue.put`) with
+        a function to run and related input args and kwargs.
 
         Worker function will be called with the queue as the first arg,
         along with the provided args and kwargs.
         """
         logger.debug("Starting thread {}".format(name))
+        self.q._local.is_worker = True
+        concurrency = self.concurrency
         while not self.killswitch.is_set():
             try:
-                func, args, kwargs = self.q.get(timeout=1)
-                signature_str = "{}({})".format(
-                    func.__name__,
-                    ', '.join([x for x in [
-                        ', '.join([repr(arg) for arg in args]),
-                        ', '.join('{}={!r}'.format(*i) for i in kwargs.items())
-                    ] if x]))
-                logger.debug("Processing %s", signature_str)
+                item = self.q.get(timeout=1)
             except moves.queue.Empty:
                 continue
             try:
-                func(self.q, *args, **kwargs)
-            except Exception:
-                logger.exception("Failed to process %s", signature_str)
+                # Only hold a slot while running, so that idle workers don't
+                # keep others from seeing the killswitch
+                if concurrency is not None:
+                    concurrency.acquire()
+                try:
+                    self.q.process(*item)
+                finally:
+                    if concurrency is not None:
+                        concurrency.release()
             finally:
                 self.q.task_done()
         logger.debug("Stopping thread {}".format(name))
+
+
+class DependencyError(Exception):
+    """ Raised in place of running a task whose dependency failed """
+
+
+class TaskGraph(object):
+    def __init__(self, cpu_multiplier=2, num_threads=None):
+        """
+        Thread pool running tasks as soon as the tasks they depend on have
+        completed. Tasks return futures; passing a future as an argument to
+        another task makes the second task depend on the first and receive
+        its result in place of the future:
+
+            with TaskGraph() as graph:
+                loc = graph.submit(create_location, org, proj, geojson)
+                party = graph.submit(create_party, org, proj, name)
+                graph.submit(create_relationship, org, proj, party, loc)
+
+        Unlike `ThreadQueue` workers, tasks are not passed a queue. A task
+        can schedule follow-up work by submitting to the graph itself.
+        Tasks whose dependencies failed are not run; their future raises
+        `DependencyError`.
+
+        Args:
+            cpu_multiplier (int, optional): Number of threads per cpu. See
+            `ThreadQueue`.
+            num_threads (int, optional): Number of threads, overriding
+            `cpu_multiplier`. Defaults to None.
+        """
+        self.num_threads = num_threads or min(
+            [(cpu_count() * cpu_multiplier) or 1, 8])
+        self._ready = moves.queue.Queue()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._threads = []
+
+    def __enter__(self):
+        logger.debug("Entering TaskGraph context")
+        for i in range(self.num_threads):
+            t = threading.Thread(
+                target=self.worker, args=("Thread-{}".format(i),))
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wait()
+        for t in self._threads:
+            self._ready.put(None)
+        for t in self._threads:
+            t.join()
+        logger.debug("Exiting TaskGraph context")
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Schedule `func(*args, **kwargs)`, to be run once all futures found in
+        args and kwargs are done. Returns a future of the result.
+        """
+        return self.submit_after((), func, *args, **kwargs)
+
+    def submit_after(self, dependencies, func, *args, **kwargs):
+        """
+        Same as `submit`, additionally waiting for the provided futures to
+        be done (without passing their results to `func`).
+        """
+        future = Future()
+        deps = list(dependencies) + [
+            a for a in itertools.chain(args, kwargs.values())
+            if isinstance(a, Future)]
+        task = (future, func, args, kwargs, deps)
+        with self._lock:
+            self._pending += 1
+        future.add_done_callback(self._task_done)
+
+        if not deps:
+            self._ready.put(task)
+            return future
+
+        remaining = [len(deps)]
+        lock = threading.Lock()
+
+        def dependency_done(dep):
+            with lock:
+                remaining[0] -= 1
+                ready = not remaining[0]
+            if ready:
+                self._ready.put(task)
+
+        for dep in deps:
+            dep.add_done_callback(dependency_done)
+        return future
+
+    def wait(self):
+        """ Block until all submitted tasks are done """
+        with self._idle:
+            while self._pending:
+                self._idle.wait()
+
+    def _task_done(self, future):
+        with self._idle:
+            self._pending -= 1
+            if not self._pending:
+                self._idle.notify_all()
+
+    def worker(self, name):
+        """
+        Thread worker. Runs tasks whose dependencies are done until it
+        receives None.
+        """
+        logger.debug("Starting thread {}".format(name))
+        for task in iter(self._ready.get, None):
+            self._run(*task)
+        logger.debug("Stopping thread {}".format(name))
+
+    def _run(self, future, func, args, kwargs, deps):
+        if not future.set_running_or_notify_cancel():
+            return
+        failed = [d for d in deps if d.cancelled() or d.exception()]
+        if failed:
+            logger.debug("Not running %s, %d dependencies failed",
+                         func.__name__, len(failed))
+            future.set_exception(DependencyError(
+                "{} of {} dependencies of {} failed".format(
+                    len(failed), len(deps), func.__name__)))
+            return
+        args = [_result(a) for a in args]
+        kwargs = {k: _result(v) for k, v in kwargs.items()}
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            logger.exception("Failed to process %s", func.__name__)
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+
+def _result(value):
+    return value.result() if isinstance(value, Future) else value
@@ -0,0 +1,6 @@
+from .directory import DirectoryImporter
+from .pipeline import Pipeline, Stage
+from .rules import FolderRule, match_rule
+
+__all__ = ('DirectoryImporter', 'FolderRule', 'Pipeline', 'Stage',
+           'match_rule')
@@ -0,0 +1,360 @@
+from __future__ import absolute_import
+
+from concurrent.futures import Future
+from multiprocessing import Pool, cpu_count
+import logging
+import os
+import threading
+
+from .. import endpoints
+from ..helpers import fs, http, string
+from .pipeline import Pipeline, Stage
+from .rules import FolderRule, match_rule
+
+__all__ = ('DirectoryImporter',)
+logger = logging.getLogger(__name__)
+
+
+class DirectoryImporter(object):
+
+    def __init__(self, session, org_slug, rules=None, journal=None,
+                 discover_workers=1, parse_workers=None,
+                 transform_workers=None, upload_workers=8, link_workers=4,
+                 maxsize=100, reproject_processes=None, simplifier=None,
+                 spatial_index=None, entities=None):
+        """
+        Import a directory of Projects, each a directory of Parties, into an
+        Organization:
+
+            - {ProjectName}/
+                - {PartyName}/
+                    - {Folder}/  (handled according to `rules`)
+
+        The import runs as a pipeline of stages, each with its own pool of
+        threads and bounded queue:
+
+            discover   Crawl Project and Party directories
+            parse      Read spatial files
+            transform  Reproject Features to EPSG:4326
+            upload     Create Projects, Parties and Locations, upload
+                       Resources
+            link       Create relationships between created records
+
+        Args:
+            session (CadastaSession): Session used to make requests.
+            org_slug (str): Slug of Organization to receive the data.
+            rules (list, optional): `FolderRule` instances selecting how the
+                folders of each Party directory are handled. Defaults to
+                `default_rules()`.
+            journal (Journal, optional): Journal used to skip work completed
+                by a previous run. Defaults to None.
+            discover_workers, parse_workers, transform_workers,
+            upload_workers, link_workers (int, optional): Number of threads
+                of each stage. Parsing and transforming default to the
+                number of CPUs.
+            maxsize (int, optional): Maximum number of pending tasks per
+                stage. Defaults to 100.
+            reproject_processes (int, optional): If set, reproject Features
+                in a pool of this many processes while parsing, instead of in
+                the threads of the transform stage, which contend for the
+                GIL. Defaults to None.
+            simplifier (geo.Simplifier, optional): If set, shrink Location
+                geometries before upload and send them compactly serialized.
+                Its summary is logged at the end of the run. Defaults to
+                None.
+            spatial_index (callable, optional): If set, called to create a
+                `geo.SpatialIndex` for each Project (e.g. `geo.SpatialIndex`
+                or a `functools.partial` of it), loaded with the Project's
+                existing Locations. Locations duplicating or heavily
+                overlapping an indexed one are linked to it rather than
+                created. Defaults to None.
+            entities (EntityCache, optional): Cache used to test whether
+                Projects exist, rather than a request per Project. Defaults
+                to None.
+        """
+        self.session = session
+        self.org_slug = org_slug
+        self.rules = self.default_rules() if rules is None else rules
+        self.journal = journal
+        self.reproject_processes = reproject_processes
+        self.simplifier = simplifier
+        self.spatial_index = spatial_index
+        self.entities = entities
+        self._indexes = {}
+        self._indexes_lock = threading.Lock()
+        self._pool = None
+        workers = (
+            ('discover', discover_workers),
+            ('parse', parse_workers or cpu_count()),
+            ('transform', transform_workers or cpu_count()),
+            ('upload', upload_workers),
+            ('link', link_workers),
+        )
+        self.stages = [Stage(name, n, maxsize) for name, n in workers]
+
+    def __repr__(self):
+        return '<{} {!r} {!r}>'.format(
+            self.__class__.__name__, self.session, self.org_slug)
+
+    def default_rules(self):
+        """
+        Handle Photo/ and GDB/ folders as Party Resources and Shp/ folders
+        as Locations.
+        """
+        return [
+            FolderRule(('photo', 'gdb'), self.schedule_party_resources),
+            FolderRule(('shp',), self.schedule_shapefiles),
+        ]
+
+    def run(self, data_dir):
+        """ Import every Project directory of data_dir """
+        # Fork the reprojection processes before the pipeline starts threads
+        if self.reproject_processes:
+            self._pool = Pool(self.reproject_processes)
+        try:
+            with Pipeline(self.stages, journal=self.journal) as pipeline:
+                for proj_dir in fs.ls_dirs(data_dir):
+                    pipeline.put('upload', self.create_project, proj_dir)
+        finally:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+            if self.simplifier is not None:
+                logger.info(self.simplifier.summary())
+
+    def _get_index(self, org_slug, proj_slug):
+        """ Return spatial index of a Project, creating it if needed """
+        with self._indexes_lock:
+            index = self._indexes.get((org_slug, proj_slug))
+            if index is None:
+                index = self._indexes[org_slug, proj_slug] = \
+                    self.spatial_index()
+                index.insert_features(self.session.get(
+                    endpoints.locations(org_slug, proj_slug),
+                    follow_pagination=True))
+            return index
+
+    def _memoize(self, key_parts, func):
+        if self.journal is None:
+            return func()
+        return self.journal.memoize(self.journal.key(*key_parts), func)
+
+    # Folder handlers
+    def schedule_party_resources(self, pipeline, org_slug, proj_slug,
+                                 party_id, folder):
+        for path in fs.ls_files(folder):
+            pipeline.put('upload', self.upload_party_resource, org_slug,
+                         proj_slug, party_id, path)
+
+    def schedule_shapefiles(self, pipeline, org_slug, proj_slug, party_id,
+                            folder):
+        for entry in fs.walk(folder, extensions=('.shp',), recursive=False):
+            pipeline.put('parse', self.parse_shapefile, org_slug, proj_slug,
+                         party_id, entry.path)
+
+    # Tasks
+    def create_project(self, pipeline, proj_dir):
+        """
+        Create a Project named after the directory (unless it already
+        exists), then schedule discovery of its Parties.
+        """
+        org_slug = self.org_slug
+        proj_name = os.path.basename(proj_dir)
+        proj_slug = string.slugify(proj_name)
+
+        proj_url = endpoints.projects(org_slug, proj_slug)
+        if self.entities is not None:
+            exists = proj_url in self.entities
+        else:
+            exists = self.session.head(proj_url)
+        if exists:
+            logger.info("Project %r (%s/%s) exists, not creating",
+                        proj_name, org_slug, proj_slug)
+        else:
+            url = endpoints.projects(org_slug)
+            proj = self.session.post(url, json={'name': proj_name}).json()
+            logger.info("Created Project %r (%s/%s)",
+                        proj_name, org_slug, proj_slug)
+            proj_slug = proj['slug']
+        pipeline.put('discover', self.discover_parties, org_slug, proj_slug,
+                     proj_dir)
+
+    def discover_parties(self, pipeline, org_slug, proj_slug, proj_dir):
+        """ Schedule creation of a Party for each directory of a Project """
+        for party_dir in fs.ls_dirs(proj_dir):
+            pipeline.put('upload', self.create_party, org_slug, proj_slug,
+                         party_dir)
+
+    def create_party(self, pipeline, org_slug, proj_slug, party_dir):
+        """
+        Create a Party named after the directory, then schedule discovery of
+        its folders.
+        """
+        # Parties have random IDs and no slug, so we can't test if they
+        # exist. The journal remembers Parties created by previous runs.
+        url = endpoints.parties(org_slug, proj_slug)
+        party_name = os.path.basename(party_dir)
+        party = self._memoize(
+            ('party', org_slug, proj_slug, party_dir),
+            lambda: self.session.post(url, json={'name': party_name}).json())
+        logger.info("Created Party %r (%s/%s/%s)",
+                    party_name, org_slug, proj_slug, party['id'])
+        pipeline.put('discover', self.discover_party_folders, org_slug,
+                     proj_slug, party['id'], party_dir)
+
+    def discover_party_folders(self, pipeline, org_slug, proj_slug, party_id,
+                               party_dir):
+        """ Hand each folder of a Party directory to its matching rule """
+        for folder in fs.ls_dirs(party_dir):
+            rule = match_rule(self.rules, os.path.basename(folder))
+            if rule is None:
+                logger.debug("No rule matches %r, skipping", folder)
+                continue
+            rule.handler(pipeline, org_slug, proj_slug, party_id, folder)
+
+    def parse_shapefile(self, pipeline, org_slug, proj_slug, party_id,
+                        shp_path):
+        """
+        Schedule transformation of the Polygons of a shapefile, and upload
+        the shapefile as a Party Resource.
+        """
+        from ..helpers import geo
+
+        if self._pool is not None:
+            for layer in geo.prepare_geodata(
+                    shp_path, pool=self._pool,
+                    processes=self.reproject_processes):
+                if layer['geometry']['type'] != 'Polygon':
+                    continue
+                pipeline.put('upload', self.upload_location, org_slug,
+                             proj_slug, party_id, layer)
+        else:
+            for layer, epsg in geo.read_geodata(shp_path):
+                if layer['geometry']['type'] != 'Polygon':
+                    continue
+                pipeline.put('transform', self.transform_location, org_slug,
+                             proj_slug, party_id, layer, epsg)
+
+        pipeline.put('upload', self.upload_shapefile, org_slug, proj_slug,
+                     party_id, shp_path)
+
+    def transform_location(self, pipeline, org_slug, proj_slug, party_id,
+                           layer, epsg):
+        """ Reproject Feature and schedule its upload as a Location """
+        from ..helpers import geo
+
+        layer = geo.transform_layer(layer, epsg=epsg)
+        pipeline.put('upload', self.upload_location, org_slug, proj_slug,
+                     party_id, layer)
+
+    def upload_location(self, pipeline, org_slug, proj_slug, party_id, layer):
+        """
+        Create Location (unless a duplicate was already found in the
+        Project), then schedule linking it to its Party
+        """
+        url = endpoints.locations(org_slug, proj_slug)
+        if self.simplifier is not None:
+            layer = self.simplifier(layer)
+            kwargs = {'data': self.simplifier.dumps(layer),
+                      'headers': {'Content-Type': 'application/json'}}
+        else:
+            kwargs = {'json': layer}
+
+        index = created = None
+        if self.spatial_index is not None:
+            index = self._get_index(org_slug, proj_slug)
+        try:
+            while index is not None:
+                # Other threads finding a duplicate of this Location wait for
+                # its creation through the future, which must be resolved
+                # whatever happens once it is in the index
+                created = Future()
+                match = index.match_or_insert(layer['geometry'], created)
+                if match is None:
+                    break
+                kind, su_id = match
+                if isinstance(su_id, Future):
+                    try:
+                        su_id = su_id.result()
+                    except Exception:
+                        # Creating the duplicate failed, and it was removed
+                        # from the index: look again, and create it if needed
+                        continue
+                logger.info("Location is %s duplicate of %s/%s/%s, linking "
+                            "it instead", kind, org_slug, proj_slug, su_id)
+                pipeline.put('link', self.link_location, org_slug, proj_slug,
+                             party_id, su_id)
+                return
+
+            spatial_unit = self._memoize(
+                ('location', org_slug, proj_slug, party_id, layer),
+                lambda: self.session.post(url, **kwargs).json())
+            su_id = spatial_unit['properties']['id']
+        except Exception as e:
+            if created is not None:
+                index.discard(layer['geometry'], created)
+                created.set_exception(e)
+            raise
+        if created is not None:
+            created.set_result(su_id)
+        pipeline.put('link', self.link_location, org_slug, proj_slug,
+                     party_id, su_id)
+
+    def link_location(self, pipeline, org_slug, proj_slug, party_id, su_id):
+        """ Create tenure relationship between Party and Location """
+        url = endpoints.tenure_relationships(org_slug, proj_slug)
+        return self.session.post(url, json={
+            'party': party_id,
+            'spatial_unit': su_id,
+            'tenure_type': 'LH',  # TODO: Verify that this is correct (https://cadasta.github.io/api-docs/#relationship-json-object)
+            'attributes': {},
+        }).json()['id']
+
+    def upload_shapefile(self, pipeline, org_slug, proj_slug, party_id,
+                         shp_path):
+        """
+        Upload a shapefile, zipped up with its sidecar files as it is sent,
+        and create Party Resource from it
+        """
+        shp_name = os.path.basename(shp_path).split('.')[0]
+        paths = [entry.path for entry in fs.walk(os.path.dirname(shp_path),
+                                                 recursive=False)
+                 if entry.name.startswith(shp_name)]
+        archive = fs.ZipStream(paths)
+        try:
+            return self.upload_party_resource(
+                pipeline, org_slug, proj_slug, party_id,
+                '{}.shp.zip'.format(shp_name), fileobj=archive)
+        finally:
+            archive.close()
+
+    def upload_party_resource(self, pipeline, org_slug, proj_slug, party_id,
+                              resource_path, fileobj=None):
+        """
+        Upload file and create Party Resource from it. If provided, the file's
+        content is read from `fileobj`, `resource_path` only naming it.
+        """
+        url = endpoints.party_resources(org_slug, proj_slug, party_id)
+        original_file = os.path.basename(resource_path)
+        name = original_file.split('.')[0]
+
+        # HACK: The `upload_to` value must match what is used on the model in
+        # the Cadasta Platform codebase. No way to get this value via API.
+        file_url = self.session.upload_file(
+            resource_path if fileobj is None else fileobj,
+            upload_to='resources', filename=original_file)
+        resource_data = {
+            'name': name,
+            'file': file_url,
+            'original_file': original_file,
+        }
+        mime_type = http.get_mime_type(resource_path)
+        if mime_type and 'zip' not in mime_type:
+            # FIXME: Zip mimetypes not currently supported.
+            resource_data.update(mime_type=mime_type)
+        resource = self.session.post(url, json=resource_data).json()
+        logger.info("Uploaded resource %r", self.session.BASE_URL +
+                    endpoints.party_resources(org_slug, proj_slug, party_id,
+                                              resource['id']))
+        return resource['id']
@@ -0,0 +1,154 @@
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import logging
+import threading
+
+from six import moves
+
+from ..helpers.threading import Queue
+
+__all__ = ('Stage', 'Pipeline')
+logger = logging.getLogger(__name__)
+
+
+class Stage(object):
+
+    def __init__(self, name, workers=1, maxsize=0, put_timeout=None):
+        """
+        Configuration of a pipeline stage.
+
+        Args:
+            name (str): Name used to schedule tasks on the stage.
+            workers (int, optional): Number of worker threads. Defaults to 1.
+            maxsize (int, optional): Maximum number of pending tasks.
+                Defaults to 0 (unbounded).
+            put_timeout (float, optional): See `threading.Queue`. Defaults to
+                None.
+        """
+        self.name = name
+        self.workers = workers
+        self.maxsize = maxsize
+        self.put_timeout = put_timeout
+
+    def __repr__(self):
+        return '<{} {!r} workers={} maxsize={}>'.format(
+            self.__class__.__name__, self.name, self.workers, self.maxsize)
+
+
+class _StageQueue(Queue):
+    """
+    Queue of a pipeline stage. Passes the pipeline to tasks and keeps count
+    of the pipeline's outstanding tasks.
+    """
+
+    def __init__(self, pipeline, stage, journal):
+        super(_StageQueue, self).__init__(
+            stage.maxsize, stage.put_timeout, journal)
+        self.stage = stage
+        self.context = pipeline
+        # Shared by all stages, so that any worker of the pipeline runs tasks
+        # inline rather than blocking on a full queue (stages may schedule
+        # work on each other, and blocking could deadlock the pipeline), and
+        # so that journaled tasks track follow-up work across stages.
+        self._local = pipeline._local
+
+    def _put(self, item):
+        # Counted before the scheduling task is marked as done, so that the
+        # count can't reach zero while work remains
+        self.context._add_outstanding(1)
+        super(_StageQueue, self)._put(item)
+
+    def task_done(self):
+        super(_StageQueue, self).task_done()
+        self.context._add_outstanding(-1)
+
+
+class Pipeline(object):
+
+    def __init__(self, stages, journal=None):
+        """
+        Set of named stages, each with its own bounded queue and pool of
+        worker threads. Tasks are scheduled on a stage with `put` and, like
+        `ThreadQueue` tasks, are called with the pipeline as their first
+        argument so that they can schedule follow-up work on any stage:
+
+            def parse(pipeline, path):
+                for feature in read(path):
+                    pipeline.put('upload', upload, feature)
+
+            stages = [Stage('parse', workers=4), Stage('upload', workers=8)]
+            with Pipeline(stages) as pipeline:
+                pipeline.put('parse', parse, path)
+
+        Exiting the context waits for all tasks, including follow-up work,
+        to be processed.
+
+        Args:
+            stages (list): `Stage` instances.
+            journal (Journal, optional): Journal of completed tasks. See
+                `ThreadQueue`. Defaults to None.
+        """
+        self._local = threading.local()
+        self._outstanding = 0
+        self._idle = threading.Condition()
+        self.killswitch = threading.Event()
+        self.queues = OrderedDict(
+            (stage.name, _StageQueue(self, stage, journal))
+            for stage in stages)
+        self._threads = []
+
+    def __repr__(self):
+        return '<{} {}>'.format(
+            self.__class__.__name__,
+            ' '.join('{}={}'.format(name, q.qsize())
+                     for name, q in self.queues.items()))
+
+    def __enter__(self):
+        logger.debug("Entering Pipeline context")
+        for q in self.queues.values():
+            for i in range(q.stage.workers):
+                t = threading.Thread(
+                    target=self.worker,
+                    args=(q, "{}-{}".format(q.stage.name, i)))
+                t.start()
+                self._threads.append(t)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wait()
+        self.killswitch.set()
+        for t in self._threads:
+            t.join()
+        logger.debug("Exiting Pipeline context")
+
+    def put(self, stage, func, *args, **kwargs):
+        """ Schedule `func` on the named stage. See `threading.Queue.put` """
+        return self.queues[stage].put(func, *args, **kwargs)
+
+    def wait(self):
+        """ Block until all scheduled tasks have been processed """
+        with self._idle:
+            while self._outstanding:
+                self._idle.wait()
+
+    def _add_outstanding(self, n):
+        with self._idle:
+            self._outstanding += n
+            if not self._outstanding:
+                self._idle.notify_all()
+
+    def worker(self, q, name):
+        """ Thread worker processing the tasks of a stage """
+        logger.debug("Starting thread {}".format(name))
+        self._local.is_worker = True
+        while not self.killswitch.is_set():
+            try:
+                item = q.get(timeout=1)
+            except moves.queue.Empty:
+                continue
+            try:
+                q.process(*item)
+            finally:
+                q.task_done()
+        logger.debug("Stopping thread {}".format(name))
@@ -0,0 +1,44 @@
+from ..helpers.string import similarity
+
+__all__ = ('FolderRule', 'match_rule')
+
+
+class FolderRule(object):
+
+    def __init__(self, names, handler, min_similarity=None):
+        """
+        Rule mapping folders with matching names to a handler.
+
+        Args:
+            names (iterable): Folder names handled by the rule. Matching is
+                case-insensitive.
+            handler (callable): Called as `handler(pipeline, org_slug,
+                proj_slug, party_id, folder_path)` for each matching folder
+                of a Party directory, typically scheduling tasks on the
+                pipeline.
+            min_similarity (float, optional): Also match folder names whose
+                `similarity` to one of the names is at least this value,
+                to tolerate typos. Defaults to None (exact matches only).
+        """
+        self.names = tuple(name.lower() for name in names)
+        self.handler = handler
+        self.min_similarity = min_similarity
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(self.__class__.__name__, self.names)
+
+    def matches(self, folder_name):
+        folder_name = folder_name.lower()
+        if folder_name in self.names:
+            return True
+        return self.min_similarity is not None and any(
+            similarity(folder_name, name) >= self.min_similarity
+            for name in self.names)
+
+
+def match_rule(rules, folder_name):
+    """ Return first rule matching folder name, or None """
+    for rule in rules:
+        if rule.matches(folder_name):
+            return rule
+    return None
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import six
+
+from .helpers.fs import file_hash
+
+__all__ = ('Journal',)
+
+
+class Journal(object):
+
+    def __init__(self, path, hash_files=True):
+        """
+        Durable, append-only record of completed work, used to resume an
+        interrupted import without repeating work that already succeeded.
+        Backed by SQLite and safe to share between threads.
+
+        Pass a journal to `ThreadQueue` to skip tasks that completed in a
+        previous run, and use `memoize` around requests that create objects
+        (e.g. Parties) that can't otherwise be tested for existence.
+
+        Args:
+            path (str): Location of the SQLite database.
+            hash_files (bool, optional): Include the content hash of any task
+                argument that is a path to a file in the task's key, so that
+                tasks are re-run when their input file changes. Defaults to
+                True.
+        """
+        self.path = path
+        self.hash_files = hash_files
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS journal ('
+                '  key TEXT PRIMARY KEY,'
+                '  source TEXT,'
+                '  content_hash TEXT,'
+                '  result TEXT,'
+                '  completed_at REAL NOT NULL)')
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(self.__class__.__name__, self.path)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM journal').fetchone()[0]
+
+    @staticmethod
+    def key(*parts):
+        """ Build a key from JSON-serializable parts """
+        data = json.dumps(parts, sort_keys=True, default=repr)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def task_key(self, func, args, kwargs):
+        """
+        Return key, source path and content hash identifying a call of
+        `func` with the provided args and kwargs.
+        """
+        name = '{}.{}'.format(func.__module__, func.__name__)
+        source = content_hash = None
+        hashes = []
+        if self.hash_files:
+            for arg in list(args) + list(kwargs.values()):
+                if isinstance(arg, six.string_types) and os.path.isfile(arg):
+                    hashes.append(file_hash(arg))
+                    if source is None:
+                        source, content_hash = arg, hashes[-1]
+        return (self.key(name, args, kwargs, hashes), source, content_hash)
+
+    def get(self, key):
+        """
+        Return record of completed work as a dict ('source', 'content_hash',
+        'result', 'completed_at'), or None if it has not completed.
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT source, content_hash, result, completed_at '
+                'FROM journal WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        source, content_hash, result, completed_at = row
+        return {
+            'source': source,
+            'content_hash': content_hash,
+            'result': json.loads(result) if result is not None else None,
+            'completed_at': completed_at,
+        }
+
+    def is_complete(self, key):
+        return self.get(key) is not None
+
+    def record(self, key, result=None, source=None, content_hash=None):
+        """
+        Durably record work as completed, along with its JSON-serializable
+        result (e.g. the ID of a created object).
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO journal VALUES (?, ?, ?, ?, ?)',
+                (key, source, content_hash,
+                 json.dumps(result, default=repr), time.time()))
+
+    def memoize(self, key, func, *args, **kwargs):
+        """
+        Return the recorded result of `key` if completed, otherwise call
+        `func(*args, **kwargs)`, record and return its result:
+
+            party = journal.memoize(
+                journal.key('party', org_slug, proj_slug, party_dir),
+                lambda: cnxn.post(url, json=party_data).json())
+        """
+        record = self.get(key)
+        if record is not None:
+            return record['result']
+        result = func(*args, **kwargs)
+        self.record(key, result)
+        return result
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
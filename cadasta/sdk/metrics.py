@@ -0,0 +1,220 @@
+from collections import defaultdict
+import bisect
+import logging
+import threading
+
+from .endpoints import resolve
+
+__all__ = ('RequestMetrics',)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _EndpointStats(object):
+
+    def __init__(self, buckets):
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.latency_sum = 0.
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.statuses = defaultdict(int)
+
+
+class RequestMetrics(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        In-memory request metrics, grouped by endpoint template (as named by
+        `endpoints.resolve`, e.g. 'parties' or 'S3_UPLOAD') and HTTP method.
+        Records a latency histogram, request and response bytes, response
+        statuses, connection errors and retries. Attach to a session to
+        observe its requests:
+
+            metrics = RequestMetrics().attach(cnxn)
+            ...
+            print(metrics.summary())
+
+        Args:
+            buckets (tuple, optional): Upper bounds in seconds of the latency
+                histogram buckets. Defaults to `DEFAULT_BUCKETS`.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._stop = None
+
+    def __repr__(self):
+        return '<{} endpoints={}>'.format(
+            self.__class__.__name__, len(self._stats))
+
+    def attach(self, session):
+        """ Observe the requests of a session """
+        session.add_observer(self)
+        return self
+
+    def __call__(self, method, url, response=None, error=None, elapsed=0,
+                 attempt=0, template=None, **kwargs):
+        key = (template or resolve(url) or 'other', method)
+        request_bytes = _request_size(response)
+        response_bytes = _response_size(response)
+        index = bisect.bisect_left(self.buckets, elapsed)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _EndpointStats(self.buckets)
+            stats.count += 1
+            stats.bucket_counts[index] += 1
+            stats.latency_sum += elapsed
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+            if attempt:
+                stats.retries += 1
+            if response is None:
+                stats.errors += 1
+            else:
+                stats.statuses[response.status_code] += 1
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted(self._stats.items())
+
+    def _quantile(self, stats, q):
+        """ Upper bound of the histogram bucket holding the q-quantile """
+        rank = q * stats.count
+        total = 0
+        for bound, count in zip(self.buckets, stats.bucket_counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        """ Return a human-readable table of the metrics """
+        lines = ['{:<24} {:<7} {:>7} {:>8} {:>8} {:>8} {:>6} {:>7} '
+                 '{:>10} {:>10}'.format(
+                     'endpoint', 'method', 'count', 'mean(s)', 'p50<=',
+                     'p95<=', 'errors', 'retries', 'sent', 'received')]
+        for (template, method), stats in self._snapshot():
+            failed = stats.errors + sum(
+                n for status, n in stats.statuses.items() if status >= 400)
+            lines.append(
+                '{:<24} {:<7} {:>7} {:>8.3f} {:>8} {:>8} {:>6} {:>7} '
+                '{:>10} {:>10}'.format(
+                    template, method, stats.count,
+                    stats.latency_sum / stats.count,
+                    self._quantile(stats, .5), self._quantile(stats, .95),
+                    failed, stats.retries, _format_bytes(stats.request_bytes),
+                    _format_bytes(stats.response_bytes)))
+        return '\n'.join(lines)
+
+    def prometheus(self, prefix='cadasta'):
+        """ Return the metrics in the Prometheus text exposition format """
+        snapshot = self._snapshot()
+        lines = []
+
+        def header(name, kind, doc):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, doc))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+
+        header('request_duration_seconds', 'histogram',
+               'Latency of requests to the Cadasta API.')
+        for (template, method), stats in snapshot:
+            labels = 'endpoint="{}",method="{}"'.format(template, method)
+            total = 0
+            bounds = [repr(float(b)) for b in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, stats.bucket_counts):
+                total += count
+                lines.append('{}_request_duration_seconds_bucket{{{},le="{}"}} '
+                             '{}'.format(prefix, labels, bound, total))
+            lines.append('{}_request_duration_seconds_sum{{{}}} {!r}'.format(
+                prefix, labels, stats.latency_sum))
+            lines.append('{}_request_duration_seconds_count{{{}}} {}'.format(
+                prefix, labels, stats.count))
+
+        header('requests_total', 'counter',
+               'Requests by response status ("error" for connection errors).')
+        for (template, method), stats in snapshot:
+            statuses = sorted(stats.statuses.items())
+            if stats.errors:
+                statuses.append(('error', stats.errors))
+            for status, count in statuses:
+                lines.append(
+                    '{}_requests_total{{endpoint="{}",method="{}",'
+                    'status="{}"}} {}'.format(
+                        prefix, template, method, status, count))
+
+        for name, attr, doc in (
+                ('request_retries_total', 'retries', 'Retried requests.'),
+                ('request_bytes_total', 'request_bytes',
+                 'Bytes of request bodies sent.'),
+                ('response_bytes_total', 'response_bytes',
+                 'Bytes of response bodies received.')):
+            header(name, 'counter', doc)
+            for (template, method), stats in snapshot:
+                lines.append('{}_{}{{endpoint="{}",method="{}"}} {}'.format(
+                    prefix, name, template, method, getattr(stats, attr)))
+        return '\n'.join(lines) + '\n'
+
+    def start_periodic_log(self, interval=60, level=logging.INFO):
+        """
+        Log the summary every `interval` seconds from a daemon thread, until
+        `stop_periodic_log` is called.
+        """
+        self.stop_periodic_log()
+        stop = self._stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                logger.log(level, "Request metrics:\n%s", self.summary())
+
+        t = threading.Thread(target=run, name='RequestMetrics')
+        t.daemon = True
+        t.start()
+
+    def stop_periodic_log(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+
+def _request_size(response):
+    body = getattr(getattr(response, 'request', None), 'body', None)
+    if body is None:
+        return 0
+    try:
+        return len(body)
+    except TypeError:  # Generators and other unsized bodies
+        return 0
+
+
+def _response_size(response):
+    """
+    Size of a response's body, from its Content-Length or, if it has none,
+    its content. The body of streamed responses is never read here, as that
+    would load it in memory before the caller gets the response.
+    """
+    if response is None:
+        return 0
+    try:
+        return int(response.headers['Content-Length'])
+    except (KeyError, TypeError, ValueError):
+        pass
+    if not getattr(response, '_content_consumed', True):
+        return 0
+    return len(response.content or b'')
+
+
+def _format_bytes(num):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if num < 1024:
+            break
+        num /= 1024.
+    return '{:.1f}{}'.format(num, unit) if unit != 'B' else '{}B'.format(num)
@@ -0,0 +1,153 @@
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+__all__ = ('TokenBucket', 'FileTokenBucket', 'RateLimiter')
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst=None):
+        """
+        Thread-safe token bucket. Tokens accumulate at `rate` per second up to
+        `burst`. Taking a token that isn't available puts the bucket into
+        debt, and the caller waits until the debt has been paid off, so
+        concurrent callers are spaced out evenly rather than polling.
+
+        Args:
+            rate (float): Number of tokens added per second.
+            burst (float, optional): Maximum number of tokens held, i.e. the
+                number of calls that may be made at once after a quiet
+                period. Defaults to `rate` (one second worth of calls).
+        """
+        assert rate > 0, "Rate must be positive"
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._level = self.burst
+        self._stamp = time.time()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<{} rate={} burst={}>'.format(
+            self.__class__.__name__, self.rate, self.burst)
+
+    def reserve(self, tokens=1):
+        """
+        Take tokens from the bucket. Returns the number of seconds the caller
+        must wait before acting on them.
+        """
+        with self._locked():
+            level, stamp = self._load()
+            now = time.time()
+            level = min(self.burst, level + (now - stamp) * self.rate)
+            level -= tokens
+            self._store(level, now)
+        return max(0., -level / self.rate)
+
+    def acquire(self, tokens=1):
+        """ Take tokens from the bucket, sleeping until they are available """
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+
+    def _locked(self):
+        return self._lock
+
+    def _load(self):
+        return self._level, self._stamp
+
+    def _store(self, level, stamp):
+        self._level, self._stamp = level, stamp
+
+
+class FileTokenBucket(TokenBucket):
+
+    def __init__(self, path, rate, burst=None):
+        """
+        Token bucket whose state is kept in a local file, so that it is
+        shared by every process (e.g. several importers on one machine)
+        using the same path. Access is serialized with an exclusive lock on
+        the file. POSIX only.
+
+        Args:
+            path (str): Location of the state file. Created if missing.
+            rate, burst: See `TokenBucket`. All processes sharing the file
+                should use the same values.
+        """
+        assert fcntl is not None, (
+            "FileTokenBucket requires fcntl (not available on Windows)")
+        super(FileTokenBucket, self).__init__(rate, burst)
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _load(self):
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        try:
+            level, stamp = os.read(self._fd, 64).decode('ascii').split()
+            return float(level), float(stamp)
+        except ValueError:  # New or corrupt file
+            return self.burst, time.time()
+
+    def _store(self, level, stamp):
+        data = '{!r} {!r}'.format(level, stamp).encode('ascii')
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.ftruncate(self._fd, 0)
+        os.write(self._fd, data)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class RateLimiter(object):
+
+    READ_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+    def __init__(self, read=None, write=None):
+        """
+        Separate request budgets for reads (GET, HEAD, OPTIONS) and writes
+        (all other methods). Share one instance between sessions, threads
+        and tasks to share its budgets:
+
+            limiter = RateLimiter(read=TokenBucket(20, burst=40),
+                                  write=TokenBucket(5, burst=10))
+            cnxn = CadastaSession(url, rate_limiter=limiter)
+
+        Args:
+            read (TokenBucket, optional): Bucket for read requests. Defaults
+                to None (unlimited).
+            write (TokenBucket, optional): Bucket for write requests.
+                Defaults to None (unlimited).
+        """
+        self.read = read
+        self.write = write
+
+    def __repr__(self):
+        return '<{} read={!r} write={!r}>'.format(
+            self.__class__.__name__, self.read, self.write)
+
+    def reserve(self, method):
+        """ Return number of seconds to wait before sending request """
+        bucket = self.read if method.upper() in self.READ_METHODS else \
+            self.write
+        return bucket.reserve() if bucket is not None else 0.
+
+    def acquire(self, method):
+        """ Sleep until request may be sent """
+        delay = self.reserve(method)
+        if delay:
+            time.sleep(delay)
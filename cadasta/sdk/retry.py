@@ -0,0 +1,111 @@
+from email.utils import parsedate_tz, mktime_tz
+import random
+import threading
+import time
+
+__all__ = ('RetryPolicy',)
+
+
+class RetryPolicy(object):
+
+    IDEMPOTENT_METHODS = frozenset(
+        ['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE'])
+    RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+    # Statuses whose "Retry-After" header is honored (RFC 7231, RFC 6585)
+    RETRY_AFTER_STATUSES = frozenset([429, 503])
+
+    def __init__(self, total=3, backoff_factor=0.5, max_backoff=120,
+                 methods=IDEMPOTENT_METHODS, statuses=RETRY_STATUSES,
+                 respect_retry_after=True, budget=None):
+        """
+        Policy describing when and how a failed request should be retried.
+
+        Args:
+            total (int, optional): Maximum number of retries for a single
+                request. Defaults to 3.
+            backoff_factor (float, optional): Base delay in seconds. The
+                delay before retry N is drawn uniformly from
+                [0, backoff_factor * 2 ** N] ("full jitter"). Defaults to 0.5.
+            max_backoff (float, optional): Upper bound in seconds of any
+                delay, including delays requested via "Retry-After".
+                Defaults to 120.
+            methods (iterable, optional): HTTP methods that are safe to
+                retry. Defaults to the idempotent methods, so a POST that
+                may have created an object is never sent twice.
+            statuses (iterable, optional): Response statuses that trigger a
+                retry. Defaults to 429, 500, 502, 503 and 504.
+            respect_retry_after (bool, optional): Honor the "Retry-After"
+                header of 429 and 503 responses. Defaults to True.
+            budget (int, optional): Maximum number of retries allowed over
+                the lifetime of a session, shared between all of its
+                threads. Once spent, failures are raised immediately.
+                Defaults to None (unlimited).
+        """
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.methods = frozenset(m.upper() for m in methods)
+        self.statuses = frozenset(statuses)
+        self.respect_retry_after = respect_retry_after
+        self.budget = budget
+
+        self._spent = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<{} total={} budget={}>'.format(
+            self.__class__.__name__, self.total, self.budget)
+
+    @property
+    def spent(self):
+        """ Number of retries consumed from the budget so far """
+        return self._spent
+
+    def is_retryable(self, method, attempt, resp=None, exc=None):
+        """
+        Return whether a request should be retried after its attempt-th
+        retry (starting at 0) produced either a response or an exception.
+        """
+        if attempt >= self.total or method.upper() not in self.methods:
+            return False
+        if resp is not None:
+            return resp.status_code in self.statuses
+        return exc is not None
+
+    def consume(self):
+        """
+        Take a retry from the budget. Returns False if the budget is spent.
+        """
+        with self._lock:
+            if self.budget is not None and self._spent >= self.budget:
+                return False
+            self._spent += 1
+            return True
+
+    def get_backoff(self, attempt, resp=None):
+        """ Return number of seconds to wait before the next attempt """
+        delay = None
+        if (self.respect_retry_after and resp is not None and
+                resp.status_code in self.RETRY_AFTER_STATUSES):
+            delay = self.parse_retry_after(
+                resp.headers.get('Retry-After'))
+        if delay is None:
+            delay = random.uniform(0, self.backoff_factor * (2 ** attempt))
+        return min(max(delay, 0), self.max_backoff)
+
+    @staticmethod
+    def parse_retry_after(value):
+        """
+        Parse a "Retry-After" header, given either as a number of seconds or
+        as an HTTP date. Returns None if missing or malformed.
+        """
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return mktime_tz(date) - time.time()
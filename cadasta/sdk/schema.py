@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import time
+
+from six.moves.urllib.parse import urlsplit
+
+from .endpoints import resolve
+
+__all__ = ('SchemaCache', 'ValidationError', 'validate')
+
+# Endpoints whose payloads are validated by sessions with `validate_payloads`
+VALIDATED_ENDPOINTS = frozenset((
+    'parties', 'party_relationships', 'locations', 'spatial_relationships',
+    'tenure_relationships',
+))
+
+
+class ValidationError(ValueError):
+
+    def __init__(self, endpoint, errors):
+        """
+        Raised when a payload doesn't fit an endpoint's schema.
+
+        Args:
+            endpoint (str): Endpoint the payload was meant for.
+            errors (list): Description of each problem found.
+        """
+        super(ValidationError, self).__init__(
+            'Invalid payload for {}: {}'.format(endpoint, '; '.join(errors)))
+        self.endpoint = endpoint
+        self.errors = errors
+
+
+class SchemaCache(object):
+
+    def __init__(self, path=None, ttl=24 * 60 * 60):
+        """
+        Cache of the `actions` metadata returned by endpoints to OPTIONS
+        requests, i.e. the fields accepted by each verb. Each endpoint is
+        requested once (detail endpoints share the schema of their
+        collection), then kept in memory and optionally on disk. Safe to
+        share between threads and sessions.
+
+        Args:
+            path (str, optional): JSON file the cache is persisted to, so that
+                schemas are reused between runs. Defaults to None (memory
+                only).
+            ttl (float, optional): Number of seconds after which a schema is
+                requested again. Defaults to one day.
+        """
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._key_locks = {}  # Held while fetching a schema
+        self._schemas = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self._schemas = json.load(f)
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(self.__class__.__name__, self.path)
+
+    def __len__(self):
+        return len(self._schemas)
+
+    def get(self, session, endpoint):
+        """
+        Return `actions` metadata of an endpoint (a dict of fields by verb),
+        requesting it with the session if not cached or expired.
+        """
+        if not endpoint.startswith('http'):
+            endpoint = session.expand_endpoint_url(endpoint)
+        key = _cache_key(endpoint)
+        with self._lock:
+            entry = self._fresh(key)
+            if entry is not None:
+                return entry['actions']
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # Only requests for the same schema wait for the fetch
+        with key_lock:
+            with self._lock:
+                entry = self._fresh(key)
+            if entry is not None:
+                return entry['actions']
+            actions = session.options(key).json().get('actions')
+            with self._lock:
+                self._schemas[key] = {
+                    'fetched_at': time.time(),
+                    'actions': actions,
+                }
+                self._save()
+        return actions
+
+    def _fresh(self, key):
+        entry = self._schemas.get(key)
+        if entry is None or time.time() - entry['fetched_at'] > self.ttl:
+            return None
+        return entry
+
+    def invalidate(self, endpoint=None):
+        """ Forget schema of an endpoint (full URL), or all schemas """
+        with self._lock:
+            if endpoint is None:
+                self._schemas = {}
+            else:
+                self._schemas.pop(_cache_key(endpoint), None)
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._schemas, f)
+        getattr(os, 'replace', os.rename)(tmp_path, self.path)
+
+
+def _cache_key(url):
+    """
+    Return URL of the collection of a detail endpoint (e.g.
+    '.../parties/{id}/' -> '.../parties/'), or the URL itself.
+    """
+    path = urlsplit(url).path.rstrip('/')
+    name = resolve(path)
+    parent = path.rsplit('/', 1)[0]
+    if name is not None and resolve(parent) == name:
+        return url[:url.index(path)] + parent + '/'
+    return url[:url.index(path)] + path + '/'
+
+
+def flatten_payload(payload):
+    """
+    Return the fields of a payload. GeoJSON Features are flattened into
+    their properties along with their geometry, as they are serialized by
+    the API.
+    """
+    if (isinstance(payload, dict) and payload.get('type') == 'Feature' and
+            'properties' in payload):
+        fields = dict(payload.get('properties') or {})
+        fields['geometry'] = payload.get('geometry')
+        return fields
+    return payload
+
+
+def validate(fields, payload, partial=False):
+    """
+    Return list of errors of a payload according to the fields metadata of
+    an endpoint's verb, checking that required fields are provided,
+    read-only fields aren't, and that choice fields hold one of their
+    choices.
+
+    Args:
+        fields (dict): Field metadata, as in the `actions` of an OPTIONS
+            response.
+        payload (dict or list): Data to validate. Each item of a list is
+            validated, with its index prefixed to its errors.
+        partial (bool, optional): Don't require required fields, as for
+            PATCH requests. Defaults to False.
+    """
+    if isinstance(payload, list):
+        return ['item {}: {}'.format(i, error)
+                for i, item in enumerate(payload)
+                for error in validate(fields, item, partial)]
+    if not isinstance(payload, dict):
+        return ['expected an object, got {}'.format(type(payload).__name__)]
+    payload = flatten_payload(payload)
+    errors = []
+    for name, meta in sorted(fields.items()):
+        read_only = meta.get('read_only')
+        if name not in payload:
+            if meta.get('required') and not read_only and not partial:
+                errors.append('{!r} is required'.format(name))
+            continue
+        if read_only:
+            errors.append('{!r} is read-only'.format(name))
+            continue
+        choices = meta.get('choices')
+        value = payload[name]
+        if not choices or value is None:
+            continue
+        allowed = set(c['value'] for c in choices)
+        values = value if isinstance(value, list) else [value]
+        invalid = [v for v in values if v not in allowed]
+        if invalid:
+            errors.append('{!r} must be one of {} (got {})'.format(
+                name, ', '.join(repr(c) for c in sorted(allowed, key=str)),
+                ', '.join(repr(v) for v in invalid)))
+    return errors
@@ -0,0 +1,91 @@
+"""
+Reprojection Benchmark
+=======================
+
+Compare the time taken to reproject Features to EPSG:4326 one at a time
+(`geo.transform_layer`, as done by default by `geo.prepare_geodata`) with
+batches of Features transformed by a single call (`geo.transform_layers`),
+and check that both produce identical output.
+
+By default, the benchmark reprojects randomly generated parcels in UTM zone
+33N. To benchmark against your own data, provide the path of an
+OGR-compatible spatial file:
+
+```bash
+file=~/Downloads/parcels.shp python examples/benchmark_reprojection.py
+```
+
+Requires fiona, numpy and pyproj.
+"""
+
+import copy
+import os
+import random
+import time
+
+from cadasta.sdk.helpers import geo
+
+
+# Path of spatial file to reproject (random parcels if not provided)
+FILE = '' or os.environ.get('file')
+# EPSG code of random parcels
+EPSG = 32633
+# Number of random parcels
+NUM_FEATURES = int('' or os.environ.get('features', 20000))
+# Number of Features transformed per call to `transform_layers`
+CHUNK_SIZE = int('' or os.environ.get('chunk_size', 256))
+
+
+def random_parcel():
+    """ Return Polygon Feature of a 20-vertex parcel """
+    x, y = random.uniform(3e5, 7e5), random.uniform(1e6, 5e6)
+    ring = [(x + random.uniform(0, 100), y + random.uniform(0, 100))
+            for _ in range(19)]
+    ring.append(ring[0])
+    return {
+        'type': 'Feature',
+        'properties': {},
+        'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+    }
+
+
+def load_features():
+    if not FILE:
+        random.seed(0)
+        return [random_parcel() for _ in range(NUM_FEATURES)], EPSG
+    features = list(geo.read_geodata(FILE, default_epsg=4326))
+    return [layer for layer, _ in features], features[0][1]
+
+
+def timed(func, layers):
+    layers = copy.deepcopy(layers)
+    start = time.time()
+    result = func(layers)
+    return result, time.time() - start
+
+
+def per_feature(layers, epsg):
+    return [geo.transform_layer(layer, epsg=epsg) for layer in layers]
+
+
+def batched(layers, epsg):
+    result = []
+    for i in range(0, len(layers), CHUNK_SIZE):
+        result += geo.transform_layers(layers[i:i + CHUNK_SIZE], epsg=epsg)
+    return result
+
+
+if __name__ == '__main__':
+    layers, epsg = load_features()
+    print("Reprojecting {} Features from EPSG:{}".format(len(layers), epsg))
+
+    expected, elapsed = timed(lambda l: per_feature(l, epsg), layers)
+    print("{:<32} {:>8.3f}s".format('per Feature (transform_layer)',
+                                    elapsed))
+    # Exclude the one-off cost of creating the transformer
+    geo.get_transformer(epsg)
+    result, batched_elapsed = timed(lambda l: batched(l, epsg), layers)
+    print("{:<32} {:>8.3f}s ({:.1f}x)".format(
+        'batched (transform_layers)', batched_elapsed,
+        elapsed / batched_elapsed))
+    print("Identical output: {}".format(result == expected))
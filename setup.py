@@ -33,5 +33,11 @@ setup(
         'keyring>=10',
         'requests>=2',
         'pyyaml>=3.12',
-    ]
+        'futures>=3; python_version<"3"',
+    ],
+
+    extras_require={
+        'geo': ['fiona', 'numpy', 'pyproj>=2.2', 'shapely>=1.7'],
+        'async': ['aiohttp>=3.3'],
+    },
 )